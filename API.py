@@ -3,33 +3,37 @@ Modal API Server for Claude Agent
 Simplified version for building websites with live preview
 """
 
+import os
+
 from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 import modal
 
-from config import app
-from models import ChatResponse, SessionStatus
-from routes import root, chat, get_session, list_sessions, delete_session
-
-# Create FastAPI web application
-web_app = FastAPI(title="Claude Agent API")
-
-# Configure CORS middleware
-web_app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=False,
-    allow_methods=["*"],
-    allow_headers=["*"],
-    expose_headers=["*"],
+from config import app, configure_logging
+from middleware import FastCORS, TTLCacheMiddleware
+from routes import router
+
+# Interactive docs and the OpenAPI schema are only served in the "dev" Modal environment
+docs_enabled = os.environ.get("MODAL_ENVIRONMENT") == "dev"
+
+# Create FastAPI web application (responses are encoded with orjson)
+web_app = FastAPI(
+    title="Claude Agent API",
+    default_response_class=ORJSONResponse,
+    docs_url="/docs" if docs_enabled else None,
+    redoc_url="/redoc" if docs_enabled else None,
+    openapi_url="/openapi.json" if docs_enabled else None,
+    swagger_ui_oauth2_redirect_url="/docs/oauth2-redirect" if docs_enabled else None,
 )
 
+# Cache rarely-changing GET responses in-process (inside CORS so hits still get headers)
+web_app.add_middleware(TTLCacheMiddleware)
+
+# Configure CORS middleware (allow everything, headers are pre-encoded)
+web_app.add_middleware(FastCORS)
+
 # Register routes
-web_app.get("/")(root)
-web_app.post("/api/chat", response_model=ChatResponse)(chat)
-web_app.get("/api/sessions/{session_id}", response_model=SessionStatus)(get_session)
-web_app.get("/api/sessions")(list_sessions)
-web_app.delete("/api/sessions/{session_id}")(delete_session)
+web_app.include_router(router)
 
 
 # Modal ASGI app entry point
@@ -37,10 +41,16 @@ web_app.delete("/api/sessions/{session_id}")(delete_session)
     image=modal.Image.debian_slim(python_version="3.12").pip_install(
         "fastapi[standard]",
         "pydantic",
+        "orjson",
         "websockets"
-    ).add_local_python_source("config", "models", "routes", "dev_server", "agent")
+    ).add_local_python_source("config", "models", "routes", "dev_server", "agent", "middleware", "timestamps"),
+    # Snapshot the container after imports so cold starts skip the import/route-build work
+    enable_memory_snapshot=True
 )
+# Handlers only await Modal RPCs, so one container can serve many requests at once
+@modal.concurrent(max_inputs=100)
 @modal.asgi_app()
 def web():
     """Entry point for Modal deployment"""
+    configure_logging()
     return web_app
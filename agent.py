@@ -3,42 +3,173 @@ Claude Agent integration for running agent in Modal sandbox
 """
 
 import os
-import time
+import operator
+import re
+import stat
+import logging
 import asyncio
-import threading
-import queue
+import contextlib
 import tempfile
-import glob
-import subprocess
 from typing import Optional
-from datetime import datetime
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.responses import ORJSONResponse
 import uvicorn
+import orjson
 import modal
 
-from config import app, agent_image, sessions, ws_urls
+from config import app, agent_image, sessions, ws_urls, configure_logging
 from dev_server import DevServerManager
+from timestamps import now_iso
 
-def send_event_factory(session_id: str, event_queue: queue.Queue):
-    """Factory function to create a send_event function for a specific session"""
+# Only installed in the sandbox image; the API container imports this module too
+with agent_image.imports():
+    from selectolax.lexbor import LexborHTMLParser
+
+# Per-event/per-block logs go to DEBUG so the streaming path skips stdout writes by default
+logger = logging.getLogger("sandbox")
+
+# Injected by the Modal secret when the container starts, so read once
+ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY")
+
+# Claude Agent SDK options shared by every session in this container
+BASE_SDK_OPTIONS = {
+    "allowed_tools": ["Read", "Write", "Edit", "Bash", "Glob", "Grep"],
+    "permission_mode": "acceptEdits",  # Auto-accepts file edits
+    "env": {"ANTHROPIC_API_KEY": ANTHROPIC_API_KEY}
+}
+
+# Upper bound on queued events coalesced into a single WebSocket frame
+MAX_EVENTS_PER_FRAME = 64
+
+# How long the sender waits for more events to join a frame, and the events that never wait
+FRAME_LINGER_SECONDS = 0.02
+FLUSH_IMMEDIATELY = frozenset({"ready_for_input", "agent_complete", "agent_error"})
+
+# Clients sent a frame concurrently before yielding back to the loop
+BROADCAST_BATCH_SIZE = 50
+
+# State events whose latest broadcast copy is replayed to clients that connect later
+REPLAY_ON_CONNECT = frozenset({"pages_discovered"})
+
+# Prompt wrappers for the first turn (build the site) and follow-up turns
+INITIAL_PROMPT_TEMPLATE = """First, run: cd {workspace}
+
+Then build a {prompt}.
+
+Create a single index.html file with:
+- Embedded CSS in a <style> tag
+- Embedded JavaScript if needed in a <script> tag
+- Modern, beautiful design
+- Responsive layout
+- Clean, professional look
+
+The file must be saved as index.html in the current directory ({workspace})."""
+
+FOLLOWUP_PROMPT_TEMPLATE = """cd {workspace}
+
+{prompt}"""
+
+# Workspaces go on tmpfs only when it has at least this much free space
+MIN_SHM_FREE_BYTES = 256 * 1024 * 1024
+
+# Events buffered while no client is reading; the oldest are dropped beyond this
+MAX_QUEUED_EVENTS = 512
+
+# Seconds allowed at shutdown for queued events to reach clients, then for the WebSocket server to stop
+EVENT_FLUSH_TIMEOUT = 5
+WS_SHUTDOWN_TIMEOUT = 5
+
+# Elements whose id anchors are listed as page sections, in document order
+SECTION_SELECTOR = ", ".join(f"{tag}[id]" for tag in ("h1", "h2", "h3", "h4", "h5", "h6", "section", "article", "nav", "aside", "div"))
+WHITESPACE_RE = re.compile(r'\s+')
+
+# Bytes of each page read for its title and sections; anchors past this are not listed
+MAX_SCAN_BYTES = 64 * 1024
+
+
+def send_event_factory(session_id: str, event_queue: asyncio.Queue, loop: asyncio.AbstractEventLoop):
+    """
+    Factory function to create the send_event/send_events functions for a specific session.
+    send_events queues several (event_type, data) pairs in one handoff.
+    """
+    dropped_count = 0
+    
+    def enqueue(events: list):
+        nonlocal dropped_count
+        for event in events:
+            if event_queue.full():
+                # Keep the most recent state: evict the oldest queued event
+                event_queue.get_nowait()
+                event_queue.task_done()
+                dropped_count += 1
+                if dropped_count % 100 == 1:
+                    logger.warning("[Sandbox:%s] Event queue full, dropped %d event(s) so far", session_id, dropped_count)
+            event_queue.put_nowait(event)
+    
+    def send_events(items: list):
+        timestamp = now_iso()
+        events = [
+            {
+                "session_id": session_id,
+                "event": event_type,
+                "timestamp": timestamp,
+                "data": data or {}
+            }
+            for event_type, data in items
+        ]
+        # Dev server startup runs in a worker thread, so hop back to the loop when needed
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            enqueue(events)
+        else:
+            loop.call_soon_threadsafe(enqueue, events)
+        logger.debug("[Sandbox:%s] Queued %d event(s)", session_id, len(events))
+    
     def send_event(event_type: str, data: Optional[dict] = None):
-        event = {
-            "session_id": session_id,
-            "event": event_type,
-            "timestamp": datetime.utcnow().isoformat(),
-            "data": data or {}
-        }
-        event_queue.put(event)
-        print(f"[Sandbox:{session_id}] Queued event '{event_type}' (queue size: {event_queue.qsize()})")
-    return send_event
+        send_events([(event_type, data)])
+    
+    return send_event, send_events
+
+
+class EmbeddedServer(uvicorn.Server):
+    """uvicorn server run as a task on an existing loop; signal handling is left to the host process"""
+    
+    def __init__(self, config: uvicorn.Config):
+        super().__init__(config)
+        # Set once startup has finished, successfully or not
+        self.startup_done = asyncio.Event()
+    
+    async def startup(self, sockets=None):
+        try:
+            await super().startup(sockets=sockets)
+        finally:
+            self.startup_done.set()
+    
+    @contextlib.contextmanager
+    def capture_signals(self):
+        yield
 
 
-def setup_websocket_server(session_id: str, event_queue: queue.Queue, prompt_queue: queue.Queue):
+def setup_websocket_server(session_id: str, event_queue: asyncio.Queue, prompt_queue: asyncio.Queue) -> EmbeddedServer:
     """Setup WebSocket server for real-time event streaming and receiving prompts"""
-    websocket_clients = []
-    websocket_lock = threading.Lock()
+    # Copy-on-write: rebuilt on connect/disconnect, read without locking
+    websocket_clients = ()
+    clients_connected = asyncio.Event()
+    broadcast_task = None
+    # event type -> last broadcast event, for REPLAY_ON_CONNECT types
+    latest_events = {}
+    
+    @contextlib.asynccontextmanager
+    async def lifespan(app: FastAPI):
+        yield
+        # Server shutdown: the broadcaster has nobody left to send to
+        if broadcast_task is not None:
+            broadcast_task.cancel()
     
-    ws_app = FastAPI()
+    ws_app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
     
     @ws_app.get("/health")
     async def health():
@@ -50,210 +181,345 @@ def setup_websocket_server(session_id: str, event_queue: queue.Queue, prompt_que
             "queued_prompts": prompt_queue.qsize()
         }
     
+    async def next_batch() -> list:
+        """Wait for an event, coalescing the burst around it into one frame"""
+        loop = asyncio.get_running_loop()
+        batch = [await event_queue.get()]
+        deadline = loop.time() + FRAME_LINGER_SECONDS
+        while len(batch) < MAX_EVENTS_PER_FRAME and batch[-1]["event"] not in FLUSH_IMMEDIATELY:
+            try:
+                batch.append(event_queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            # Linger briefly so bursts spread over a few ms share one frame
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(event_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+    
+    async def send_frame(batch: list):
+        """Encode a frame once and send it to every connected client, dropping clients that fail"""
+        nonlocal websocket_clients
+        # Text frames, since the browser client JSON.parses string data
+        payload = orjson.dumps({"batch": batch}).decode()
+        # Recorded before the client snapshot, so a client registering after it replays this copy
+        for event in batch:
+            if event["event"] in REPLAY_ON_CONNECT:
+                latest_events[event["event"]] = event
+        clients = websocket_clients
+        failed = []
+        for start in range(0, len(clients), BROADCAST_BATCH_SIZE):
+            chunk = clients[start:start + BROADCAST_BATCH_SIZE]
+            # Concurrent sends so one slow client does not hold up the rest
+            results = await asyncio.gather(*(client.send_text(payload) for client in chunk), return_exceptions=True)
+            for client, result in zip(chunk, results):
+                if isinstance(result, Exception):
+                    logger.error("[Sandbox:%s] Error sending event to client %s: %s: %s", session_id, id(client), type(result).__name__, result)
+                    failed.append(client)
+            await asyncio.sleep(0)
+        if failed:
+            # Dead connections stop receiving; their endpoints finish cleanup on disconnect
+            websocket_clients = tuple(client for client in websocket_clients if client not in failed)
+            if not websocket_clients:
+                clients_connected.clear()
+        logger.debug("[Sandbox:%s] Sent %d event(s) to %d client(s)", session_id, len(batch), len(websocket_clients))
+    
+    async def broadcast_events():
+        """Single queue reader: forward each batch of queued events to the connected clients"""
+        while True:
+            # Leave events queued until someone is listening
+            await clients_connected.wait()
+            batch = await next_batch()
+            if not websocket_clients:
+                # Everyone left while the frame was filling; hold it for the next client
+                await clients_connected.wait()
+            try:
+                await send_frame(batch)
+            except Exception:
+                # e.g. an event payload orjson cannot encode - lose this frame, not the stream
+                logger.exception("[Sandbox:%s] Dropped a frame of %d event(s)", session_id, len(batch))
+            finally:
+                # Lets shutdown wait on event_queue.join() for the final frames
+                for _ in batch:
+                    event_queue.task_done()
+    
+    def start_broadcast():
+        """Start (or restart) the broadcast task"""
+        nonlocal broadcast_task
+        broadcast_task = asyncio.create_task(broadcast_events())
+        broadcast_task.add_done_callback(on_broadcast_done)
+    
+    def on_broadcast_done(task: asyncio.Task):
+        if task.cancelled():
+            return
+        # The loop never returns, so getting here means something escaped it
+        logger.error("[Sandbox:%s] Broadcast task exited unexpectedly, restarting", session_id, exc_info=task.exception())
+        start_broadcast()
+    
     @ws_app.websocket("/ws")
     async def websocket_endpoint(websocket: WebSocket):
+        nonlocal websocket_clients, broadcast_task
         client_id = id(websocket)
         await websocket.accept()
-        print(f"[Sandbox:{session_id}] WebSocket client {client_id} connected (total clients: {len(websocket_clients) + 1})")
-        
-        with websocket_lock:
-            websocket_clients.append(websocket)
+        logger.info("[Sandbox:%s] WebSocket client %s connected (total clients: %s)", session_id, client_id, len(websocket_clients) + 1)
         
         try:
-            await websocket.send_json({
+            await websocket.send_text(orjson.dumps({
                 "event": "connected",
                 "session_id": session_id,
-                "timestamp": datetime.utcnow().isoformat(),
+                "timestamp": now_iso(),
                 "client_id": client_id
-            })
-            
-            async def send_queued_events():
-                """Send events from the queue to the client"""
-                while True:
-                    try:
-                        event = event_queue.get_nowait()
-                        await websocket.send_json(event)
-                        print(f"[Sandbox:{session_id}] Sent event '{event['event']}' to client")
-                    except queue.Empty:
-                        await asyncio.sleep(0.05)
-                    except Exception as e:
-                        print(f"[Sandbox:{session_id}] Error sending event: {type(e).__name__}: {e}")
-                        break
+            }).decode())
             
-            async def receive_prompts():
-                """Receive prompts from the client"""
-                while True:
-                    try:
-                        data = await websocket.receive_json()
-                        if data.get("type") == "prompt":
-                            prompt = data.get("message")
-                            if prompt:
-                                print(f"[Sandbox:{session_id}] Received new prompt via WebSocket: {prompt[:100]}...")
-                                prompt_queue.put(prompt)
-                    except Exception as e:
-                        print(f"[Sandbox:{session_id}] Error receiving prompt: {type(e).__name__}: {e}")
-                        break
+            # Catch up on state sent before this client arrived (e.g. the page list), resending
+            # if a newer copy went out meanwhile; registration follows with no await in between
+            replayed = ()
+            while (replay := tuple(latest_events.values())) != replayed:
+                await websocket.send_text(orjson.dumps({"batch": list(replay)}).decode())
+                replayed = replay
             
-            send_task = asyncio.create_task(send_queued_events())
-            receive_task = asyncio.create_task(receive_prompts())
+            # Registered after the greeting so broadcasts never arrive ahead of it
+            websocket_clients = websocket_clients + (websocket,)
+            clients_connected.set()
+            if broadcast_task is None:
+                start_broadcast()
             
-            try:
-                # Wait for either task to complete (usually on disconnect)
-                await asyncio.gather(send_task, receive_task)
-            finally:
-                send_task.cancel()
-                receive_task.cancel()
+            # Receive prompts from the client until it goes away
+            while True:
+                try:
+                    data = await websocket.receive_json()
+                    if data.get("type") == "prompt":
+                        prompt = data.get("message")
+                        if prompt:
+                            logger.info("[Sandbox:%s] Received new prompt via WebSocket: %s...", session_id, prompt[:100])
+                            prompt_queue.put_nowait(prompt)
+                except Exception as e:
+                    logger.error("[Sandbox:%s] Error receiving prompt: %s: %s", session_id, type(e).__name__, e)
+                    break
                 
         except WebSocketDisconnect:
-            print(f"[Sandbox:{session_id}] WebSocket client {client_id} disconnected (remaining clients: {len(websocket_clients) - 1})")
+            logger.info("[Sandbox:%s] WebSocket client %s disconnected (remaining clients: %s)", session_id, client_id, len(websocket_clients) - 1)
         except Exception as e:
-            print(f"[Sandbox:{session_id}] WebSocket client {client_id} error: {type(e).__name__}: {e}")
+            logger.error("[Sandbox:%s] WebSocket client %s error: %s: %s", session_id, client_id, type(e).__name__, e)
         finally:
-            with websocket_lock:
-                if websocket in websocket_clients:
-                    websocket_clients.remove(websocket)
-            print(f"[Sandbox:{session_id}] WebSocket client {client_id} cleaned up")
-    
-    def run_websocket_server():
-        print(f"[Sandbox:{session_id}] Starting WebSocket server on port 8080")
-        uvicorn.run(ws_app, host="0.0.0.0", port=8080, log_level="error")
+            websocket_clients = tuple(client for client in websocket_clients if client is not websocket)
+            if not websocket_clients:
+                clients_connected.clear()
+            logger.info("[Sandbox:%s] WebSocket client %s cleaned up", session_id, client_id)
     
-    return run_websocket_server
+    # httptools: C HTTP parser for the upgrade handshake and /health
+    return EmbeddedServer(uvicorn.Config(ws_app, host="0.0.0.0", port=8080, log_level="error", http="httptools"))
+
+
+def workspace_base_dir() -> str:
+    """Prefer RAM-backed /dev/shm for workspaces, falling back to /tmp when it is missing or small"""
+    try:
+        shm = os.statvfs("/dev/shm")
+        if shm.f_bavail * shm.f_frsize >= MIN_SHM_FREE_BYTES:
+            return "/dev/shm"
+    except OSError:
+        pass
+    return "/tmp"
 
 
 def setup_workspace(session_id: str) -> str:
     """Create and configure workspace directory"""
-    workspace = tempfile.mkdtemp(prefix=f"session-{session_id}-", dir="/tmp")
-    print(f"[Sandbox:{session_id}] Workspace created at {workspace}")
+    workspace = tempfile.mkdtemp(prefix=f"session-{session_id}-", dir=workspace_base_dir())
+    logger.info("[Sandbox:%s] Workspace created at %s", session_id, workspace)
     
     # Set permissions on workspace directory so claudeuser can access it
     try:
         os.chmod(workspace, 0o755)  # rwxr-xr-x - everyone can read and execute
-        print(f"[Sandbox:{session_id}] Set permissions on workspace directory")
+        logger.info("[Sandbox:%s] Set permissions on workspace directory", session_id)
     except Exception as e:
-        print(f"[Sandbox:{session_id}] Warning: Could not set workspace dir permissions: {e}")
+        logger.warning("[Sandbox:%s] Warning: Could not set workspace dir permissions: %s", session_id, e)
     
     return workspace
 
 
+def make_world_readable(path: str):
+    """In-process equivalent of `chmod -R a+rX path` (symlinks are left alone)"""
+    # Skip chmod when the bits are already there, as they usually are for generated files
+    mode = stat.S_IMODE(os.stat(path).st_mode)
+    if mode & 0o555 != 0o555:
+        os.chmod(path, mode | 0o555)
+    with os.scandir(path) as it:
+        for entry in it:
+            # Entry types come from readdir, so no lstat is needed to classify
+            if entry.is_symlink():
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                make_world_readable(entry.path)
+                continue
+            mode = stat.S_IMODE(entry.stat(follow_symlinks=False).st_mode)
+            # Capital X: add execute for everyone only if someone can already execute
+            extra = 0o555 if mode & 0o111 else 0o444
+            if mode & extra != extra:
+                os.chmod(entry.path, mode | extra)
+
+
 def verify_workspace_files(session_id: str, workspace: str):
     """Verify files were created and fix permissions"""
-    workspace_files = glob.glob(f"{workspace}/*")
-    print(f"[Sandbox:{session_id}] Workspace verification: {len(workspace_files)} files created")
+    with os.scandir(workspace) as it:
+        workspace_files = [entry.name for entry in it if not entry.name.startswith(".")]
+    logger.info("[Sandbox:%s] Workspace verification: %s files created", session_id, len(workspace_files))
     
     # Check for index.html specifically
     index_path = os.path.join(workspace, "index.html")
-    if os.path.exists(index_path):
-        file_size = os.path.getsize(index_path)
-        
-        # Check current permissions
-        file_stat = os.stat(index_path)
-        file_mode = oct(file_stat.st_mode)[-3:]
-        print(f"[Sandbox:{session_id}] ✓ index.html exists ({file_size} bytes, permissions: {file_mode})")
+    try:
+        # One stat for existence, size and current permissions
+        index_stat = os.stat(index_path)
+    except FileNotFoundError:
+        index_stat = None
+    if index_stat is not None:
+        file_mode = oct(index_stat.st_mode)[-3:]
+        logger.info("[Sandbox:%s] ✓ index.html exists (%s bytes, permissions: %s)", session_id, index_stat.st_size, file_mode)
         
-        # Fix permissions to ensure HTTP server can read it
-        try:
-            os.chmod(index_path, 0o644)  # rw-r--r--
-            print(f"[Sandbox:{session_id}] Set read permissions on index.html (644)")
-        except Exception as e:
-            print(f"[Sandbox:{session_id}] Could not set file permissions: {e}")
+        # Fix permissions to ensure HTTP server can read it (the stat above shows whether it is needed)
+        if stat.S_IMODE(index_stat.st_mode) != 0o644:
+            try:
+                os.chmod(index_path, 0o644)  # rw-r--r--
+                logger.info("[Sandbox:%s] Set read permissions on index.html (644)", session_id)
+            except Exception as e:
+                logger.warning("[Sandbox:%s] Could not set file permissions: %s", session_id, e)
         
-        # Read first few lines to verify content
+        # Peek at the start to verify content (bounded, since minified pages can be one huge line)
         try:
-            with open(index_path, 'r') as f:
-                first_line = f.readline().strip()
-                print(f"[Sandbox:{session_id}] First line: {first_line[:100]}")
+            with open(index_path, 'rb') as f:
+                head = f.read(256)
+            first_line = head.decode('utf-8', errors='ignore').partition('\n')[0].strip()
+            logger.info("[Sandbox:%s] First line: %s", session_id, first_line[:100])
         except Exception as e:
-            print(f"[Sandbox:{session_id}] Could not read index.html: {e}")
+            logger.warning("[Sandbox:%s] Could not read index.html: %s", session_id, e)
     else:
-        print(f"[Sandbox:{session_id}] ✗ WARNING: index.html not found!")
-        print(f"[Sandbox:{session_id}] Files in workspace:")
-        for file in workspace_files[:10]:
-            print(f"[Sandbox:{session_id}]   - {os.path.basename(file)}")
+        logger.warning("[Sandbox:%s] ✗ WARNING: index.html not found!", session_id)
+        logger.info("[Sandbox:%s] Files in workspace:", session_id)
+        for file_name in workspace_files[:10]:
+            logger.info("[Sandbox:%s]   - %s", session_id, file_name)
     
     # Fix permissions on workspace directory and files
     try:
-        # Check workspace directory permissions first
-        dir_stat = os.stat(workspace)
-        dir_mode = oct(dir_stat.st_mode)[-3:]
-        print(f"[Sandbox:{session_id}] Workspace dir permissions before fix: {dir_mode}")
+        # Permission reports cost an extra stat each, so only when debugging
+        log_modes = logger.isEnabledFor(logging.DEBUG)
+        if log_modes:
+            logger.debug("[Sandbox:%s] Workspace dir permissions before fix: %s", session_id, oct(os.stat(workspace).st_mode)[-3:])
         
         # Need both read and execute on directories, read on files
-        os.system(f"chmod -R a+rX {workspace}")  # Capital X = execute only on directories
+        make_world_readable(workspace)
         
-        # Verify after
-        dir_stat = os.stat(workspace)
-        dir_mode = oct(dir_stat.st_mode)[-3:]
-        print(f"[Sandbox:{session_id}] Workspace dir permissions after fix: {dir_mode}")
+        if log_modes:
+            logger.debug("[Sandbox:%s] Workspace dir permissions after fix: %s", session_id, oct(os.stat(workspace).st_mode)[-3:])
     except Exception as e:
-        print(f"[Sandbox:{session_id}] Could not set workspace permissions: {e}")
+        logger.warning("[Sandbox:%s] Could not set workspace permissions: %s", session_id, e)
+
 
+def iter_html_files(directory: str, prefix: str = ""):
+    """Yield (relative path, DirEntry) for every .html file below directory, skipping dotfiles like glob"""
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.startswith(".") or entry.is_symlink():
+                continue
+            rel_path = prefix + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_html_files(entry.path, rel_path + os.sep)
+            elif entry.name.endswith(".html"):
+                yield rel_path, entry
 
-def scan_workspace_pages(session_id: str, workspace: str) -> dict:
+
+def parse_page(rel_path: str, path: str) -> dict:
+    """Extract the title and id-anchored sections of one HTML page"""
+    with open(path, 'rb') as f:
+        head = f.read(MAX_SCAN_BYTES)
+    if len(head) == MAX_SCAN_BYTES:
+        logger.debug("Only the first %d bytes of %s were scanned", MAX_SCAN_BYTES, rel_path)
+    content = head.decode('utf-8', errors='ignore')
+    
+    tree = LexborHTMLParser(content)
+    title_node = tree.css_first("title")
+    title = title_node.text(strip=True) if title_node else rel_path
+    
+    sections = []
+    for node in tree.css(SECTION_SELECTOR):
+        element_type = node.tag
+        section_id = node.attributes.get("id")
+        if not section_id:
+            continue
+        
+        text_content = WHITESPACE_RE.sub(' ', node.text()).strip()
+        
+        if len(text_content) > 50:
+            text_content = text_content[:50] + '...'
+        
+        section_name = text_content if text_content else section_id
+        
+        sections.append({
+            "id": section_id,
+            "name": section_name,
+            "element": element_type
+        })
+        
+        if len(sections) >= 20:
+            break
+    
+    if rel_path == 'index.html':
+        url_path = '/'
+    else:
+        url_path = '/' + (rel_path if os.sep == '/' else rel_path.replace(os.sep, '/'))
+    
+    return {
+        "path": rel_path,
+        "title": title,
+        "url": url_path,
+        "sections": sections
+    }
+
+
+def scan_workspace_pages(session_id: str, workspace: str, page_cache: dict) -> dict:
     """
     Scan workspace for HTML files and extract page structure with sections.
     Returns a dict with pages, their titles, and internal sections/anchors.
+    page_cache ({relative path: ((mtime_ns, size), page)}) is reused and refreshed across scans.
     """
-    import re
-    
     pages = []
-    html_files = list(set(glob.glob(f"{workspace}/*.html") + glob.glob(f"{workspace}/**/*.html", recursive=True)))
+    html_files = list(iter_html_files(workspace))
     
-    print(f"[Sandbox:{session_id}] Scanning for HTML files in {workspace}...")
-    print(f"[Sandbox:{session_id}] Found {len(html_files)} HTML files")
+    logger.info("[Sandbox:%s] Scanning for HTML files in %s...", session_id, workspace)
+    logger.info("[Sandbox:%s] Found %s HTML files", session_id, len(html_files))
     
-    for html_file in html_files:
+    scanned_pages = {}
+    
+    for rel_path, entry in html_files:
         try:
-            rel_path = os.path.relpath(html_file, workspace)
-            
-            with open(html_file, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-            
-            title_match = re.search(r'<title[^>]*>(.*?)</title>', content, re.IGNORECASE | re.DOTALL)
-            title = title_match.group(1).strip() if title_match else rel_path
-            
-            sections = []
-            id_pattern = r'<(h[1-6]|section|article|nav|aside|div)[^>]*\sid=["\']([^"\']+)["\'][^>]*>(.*?)</\1>'
-            
-            for match in re.finditer(id_pattern, content, re.IGNORECASE | re.DOTALL):
-                element_type = match.group(1)
-                section_id = match.group(2)
-                inner_content = match.group(3)
-                
-                text_content = re.sub(r'<[^>]+>', '', inner_content).strip()
-                text_content = re.sub(r'\s+', ' ', text_content)
-                
-                if len(text_content) > 50:
-                    text_content = text_content[:50] + '...'
-                
-                section_name = text_content if text_content else section_id
-                
-                sections.append({
-                    "id": section_id,
-                    "name": section_name,
-                    "element": element_type
-                })
-                
-                if len(sections) >= 20:
-                    break
-            
-            url_path = '/' + rel_path.replace('\\', '/')
-            if url_path == '/index.html':
-                url_path = '/'
-            
-            pages.append({
-                "path": rel_path,
-                "title": title,
-                "url": url_path,
-                "sections": sections
-            })
+            # Unchanged files (same mtime and size) reuse the page parsed on an earlier turn
+            file_stat = entry.stat()
+            stamp = (file_stat.st_mtime_ns, file_stat.st_size)
+            cached = page_cache.get(rel_path)
+            if cached is not None and cached[0] == stamp:
+                page = cached[1]
+            else:
+                page = parse_page(rel_path, entry.path)
+                logger.info("[Sandbox:%s] Page: %s - %s (%s sections)", session_id, rel_path, page['title'], len(page['sections']))
             
-            print(f"[Sandbox:{session_id}] Page: {rel_path} - {title} ({len(sections)} sections)")
+            scanned_pages[rel_path] = (stamp, page)
+            pages.append(page)
             
         except Exception as e:
-            print(f"[Sandbox:{session_id}] Error scanning {html_file}: {type(e).__name__}: {e}")
+            logger.error("[Sandbox:%s] Error scanning %s: %s: %s", session_id, entry.path, type(e).__name__, e)
     
-    pages.sort(key=lambda p: (p['path'] != 'index.html', p['path']))
+    # Rebuilt each scan so deleted pages drop out
+    page_cache.clear()
+    page_cache.update(scanned_pages)
+    
+    # Alphabetical, with the home page first
+    pages.sort(key=operator.itemgetter('path'))
+    home = next((i for i, page in enumerate(pages) if page['path'] == 'index.html'), None)
+    if home:
+        pages.insert(0, pages.pop(home))
     
     return {
         "pages": pages,
@@ -262,34 +528,81 @@ def scan_workspace_pages(session_id: str, workspace: str) -> dict:
     }
 
 
-async def run_claude_agent_multiturn(session_id: str, initial_prompt: str, workspace: str, send_event, prompt_queue: queue.Queue, dev_tunnel_url: str, ws_tunnel_url: str):
-    """Run the Claude Agent SDK with support for multiple prompts"""
+# Block handlers return (event_type, data) so a message's blocks are queued together
+def handle_text(session_id: str, block, turn_number: int, event_number: int):
+    logger.debug("[Sandbox:%s] Turn %d Text: %.100s...", session_id, turn_number, block.text)
+    return "claude_text", {
+        "text": block.text,
+        "turn": turn_number,
+        "event_number": event_number
+    }
+
+
+def handle_thinking(session_id: str, block, turn_number: int, event_number: int):
+    return "claude_thinking", {
+        "thinking": block.thinking,
+        "turn": turn_number,
+        "event_number": event_number
+    }
+
+
+def handle_tool_use(session_id: str, block, turn_number: int, event_number: int):
+    logger.debug("[Sandbox:%s] Turn %d Tool use: %s", session_id, turn_number, block.name)
+    return "claude_tool_use", {
+        "tool": block.name,
+        "input": block.input,
+        "tool_use_id": block.id,
+        "turn": turn_number,
+        "event_number": event_number
+    }
+
+
+def handle_tool_result(session_id: str, block, turn_number: int, event_number: int):
+    # Structured (list) content is passed through for orjson to encode as-is
+    result = block.content if isinstance(block.content, (str, list)) else ""
+
+    logger.debug("[Sandbox:%s] Turn %d Tool result for %s", session_id, turn_number, block.tool_use_id)
+    return "claude_tool_result", {
+        "tool_use_id": block.tool_use_id,
+        "result": result,
+        "is_error": block.is_error or False,
+        "turn": turn_number,
+        "event_number": event_number
+    }
+
+
+# The SDK is only installed in the sandbox image; the API container imports this module too
+with agent_image.imports():
     from claude_agent_sdk import (
         ClaudeSDKClient, ClaudeAgentOptions, AssistantMessage, TextBlock,
         ThinkingBlock, ToolUseBlock, ToolResultBlock, ResultMessage
     )
     
-    anthropic_api_key = os.environ.get("ANTHROPIC_API_KEY")
-    if not anthropic_api_key:
+    # Content block handlers keyed by exact block type
+    BLOCK_HANDLERS = {
+        TextBlock: handle_text,
+        ThinkingBlock: handle_thinking,
+        ToolUseBlock: handle_tool_use,
+        ToolResultBlock: handle_tool_result,
+    }
+
+
+async def run_claude_agent_multiturn(session_id: str, initial_prompt: str, workspace: str, send_event, send_events, prompt_queue: asyncio.Queue, dev_server: DevServerManager):
+    """Run the Claude Agent SDK with support for multiple prompts"""
+    if not ANTHROPIC_API_KEY:
         error_msg = "ANTHROPIC_API_KEY secret is missing"
-        print(f"[Sandbox:{session_id}] ERROR: {error_msg}")
+        logger.error("[Sandbox:%s] ERROR: %s", session_id, error_msg)
         raise ValueError(error_msg)
     
-    print(f"[Sandbox:{session_id}] ANTHROPIC_API_KEY found")
+    logger.info("[Sandbox:%s] ANTHROPIC_API_KEY found", session_id)
     
-    # Configure Claude Agent SDK options
-    sdk_options = ClaudeAgentOptions(
-        allowed_tools=["Read", "Write", "Edit", "Bash", "Glob", "Grep"],
-        permission_mode="acceptEdits",  # Auto-accepts file edits
-        cwd=workspace,
-        env={"ANTHROPIC_API_KEY": anthropic_api_key}
-    )
+    # Configure Claude Agent SDK options; only the working directory varies per session
+    sdk_options = ClaudeAgentOptions(**BASE_SDK_OPTIONS, cwd=workspace)
     
     total_event_count = 0
     turn_count = 0
-    dev_server = None
     
-    print(f"[Sandbox:{session_id}] Connecting to Claude Agent SDK...")
+    logger.info("[Sandbox:%s] Connecting to Claude Agent SDK...", session_id)
     async with ClaudeSDKClient(options=sdk_options) as client:
         
         async def process_prompt(prompt: str, turn_number: int):
@@ -297,30 +610,15 @@ async def run_claude_agent_multiturn(session_id: str, initial_prompt: str, works
             nonlocal total_event_count
             
             # Create a prompt for building websites
-            if turn_number == 1:
-                full_prompt = f"""First, run: cd {workspace}
-
-Then build a {prompt}.
-
-Create a single index.html file with:
-- Embedded CSS in a <style> tag
-- Embedded JavaScript if needed in a <script> tag
-- Modern, beautiful design
-- Responsive layout
-- Clean, professional look
-
-The file must be saved as index.html in the current directory ({workspace})."""
-            else:
-                full_prompt = f"""cd {workspace}
-
-{prompt}"""
+            template = INITIAL_PROMPT_TEMPLATE if turn_number == 1 else FOLLOWUP_PROMPT_TEMPLATE
+            full_prompt = template.format(workspace=workspace, prompt=prompt)
             
-            print(f"[Sandbox:{session_id}] Turn {turn_number}: Sending prompt to Claude...")
+            logger.info("[Sandbox:%s] Turn %s: Sending prompt to Claude...", session_id, turn_number)
             send_event("turn_start", {"turn": turn_number, "prompt": prompt[:100]})
             
             await client.query(full_prompt)
             
-            print(f"[Sandbox:{session_id}] Turn {turn_number}: Streaming Claude SDK messages...")
+            logger.info("[Sandbox:%s] Turn %s: Streaming Claude SDK messages...", session_id, turn_number)
             event_count = 0
             claude_session_id = None
             
@@ -329,50 +627,25 @@ The file must be saved as index.html in the current directory ({workspace})."""
                 total_event_count += 1
                 
                 # Handle different message types
-                if isinstance(message, AssistantMessage):
+                message_type = type(message)
+                if message_type is AssistantMessage:
+                    block_events = []
                     for block in message.content:
-                        if isinstance(block, TextBlock):
-                            send_event("claude_text", {
-                                "text": block.text,
-                                "turn": turn_number,
-                                "event_number": total_event_count
-                            })
-                            print(f"[Sandbox:{session_id}] Turn {turn_number} Text: {block.text[:100]}...")
-                        
-                        elif isinstance(block, ThinkingBlock):
-                            send_event("claude_thinking", {
-                                "thinking": block.thinking,
-                                "turn": turn_number,
-                                "event_number": total_event_count
-                            })
-                        
-                        elif isinstance(block, ToolUseBlock):
-                            send_event("claude_tool_use", {
-                                "tool": block.name,
-                                "input": block.input,
-                                "tool_use_id": block.id,
-                                "turn": turn_number,
-                                "event_number": total_event_count
-                            })
-                            print(f"[Sandbox:{session_id}] Turn {turn_number} Tool use: {block.name}")
-                        
-                        elif isinstance(block, ToolResultBlock):
-                            result_text = ""
-                            if isinstance(block.content, str):
-                                result_text = block.content
-                            elif isinstance(block.content, list):
-                                result_text = str(block.content)
-                            
-                            send_event("claude_tool_result", {
-                                "tool_use_id": block.tool_use_id,
-                                "result": result_text,
-                                "is_error": block.is_error or False,
-                                "turn": turn_number,
-                                "event_number": total_event_count
-                            })
-                            print(f"[Sandbox:{session_id}] Turn {turn_number} Tool result for {block.tool_use_id}")
+                        block_type = type(block)
+                        if block_type is TextBlock:
+                            # Merge adjacent fragments into one claude_text; drop blank ones that would stand alone
+                            if block_events and block_events[-1][0] == "claude_text":
+                                block_events[-1][1]["text"] += block.text
+                                continue
+                            if not block.text or block.text.isspace():
+                                continue
+                        handler = BLOCK_HANDLERS.get(block_type)
+                        if handler:
+                            block_events.append(handler(session_id, block, turn_number, total_event_count))
+                    if block_events:
+                        send_events(block_events)
                 
-                elif isinstance(message, ResultMessage):
+                elif message_type is ResultMessage:
                     claude_session_id = message.session_id
                     exit_code = 1 if message.is_error else 0
                     
@@ -386,88 +659,85 @@ The file must be saved as index.html in the current directory ({workspace})."""
                         "event_number": total_event_count
                     })
                     
-                    print(f"[Sandbox:{session_id}] Turn {turn_number} completed: {claude_session_id} (SDK turns: {message.num_turns}, cost: ${message.total_cost_usd})")
+                    logger.info("[Sandbox:%s] Turn %s completed: %s (SDK turns: %s, cost: $%s)", session_id, turn_number, claude_session_id, message.num_turns, message.total_cost_usd)
                     return exit_code
                 
                 if event_count % 50 == 0:
-                    print(f"[Sandbox:{session_id}] Turn {turn_number}: Processed {event_count} SDK messages...")
+                    logger.info("[Sandbox:%s] Turn %s: Processed %s SDK messages...", session_id, turn_number, event_count)
             
             return 0
         
+        last_structure = None
+        # Parsed pages for this session only, so nothing outlives the sandbox run
+        page_cache = {}
+        
+        async def send_pages_if_changed():
+            """Rescan the workspace, sending pages_discovered only when the structure differs from the last one sent"""
+            nonlocal last_structure
+            # Directory walk, stats and HTML parsing stay off the loop serving the WebSocket
+            structure = await asyncio.to_thread(scan_workspace_pages, session_id, workspace, page_cache)
+            if structure != last_structure:
+                send_event("pages_discovered", structure)
+                last_structure = structure
+        
         # Process initial prompt
         turn_count += 1
         await process_prompt(initial_prompt, turn_count)
         send_event("first_turn_complete", {"turn": turn_count})
         
-        # Verify files and fix permissions
-        verify_workspace_files(session_id, workspace)
+        # Verify files and fix permissions (filesystem walk, so off the loop)
+        await asyncio.to_thread(verify_workspace_files, session_id, workspace)
         
         # Get and send initial website structure
-        structure = scan_workspace_pages(session_id, workspace)
-        send_event("pages_discovered", structure)
+        await send_pages_if_changed()
         
         # Start development server now that files have been created
-        print(f"[Sandbox:{session_id}] Starting dev server at {dev_tunnel_url}...")
+        logger.info("[Sandbox:%s] Starting dev server at %s...", session_id, dev_server.dev_tunnel_url)
         send_event("dev_server_starting", {})
         
-        dev_server = DevServerManager(
-            session_id=session_id,
-            work_dir=workspace,
-            dev_tunnel_url=dev_tunnel_url,
-            ws_tunnel_url=ws_tunnel_url,
-            send_event=send_event
-        )
-        dev_server.process = dev_server.start()
+        # Startup probing blocks, so keep it off the loop serving the WebSocket
+        dev_server.process = await asyncio.to_thread(dev_server.start)
         
         if dev_server.process:
             send_event("dev_server_started", {
-                "tunnel_url": dev_tunnel_url,
-                "websocket_url": ws_tunnel_url
+                "tunnel_url": dev_server.dev_tunnel_url,
+                "websocket_url": dev_server.ws_tunnel_url
             })
-            print(f"[Sandbox:{session_id}] Dev server started at {dev_tunnel_url}")
+            logger.info("[Sandbox:%s] Dev server started at %s", session_id, dev_server.dev_tunnel_url)
             dev_server.start_monitor()
         else:
-            send_event("dev_server_failed", {"error": "Failed to start server"})
-            print(f"[Sandbox:{session_id}] WARNING: Dev server failed to start")
+            # start() has already sent dev_server_failed with the specific error
+            logger.warning("[Sandbox:%s] WARNING: Dev server failed to start", session_id)
         
         send_event("ready_for_input", {"turn": turn_count})
         
         # Send updated structure after dev server is ready
-        structure = scan_workspace_pages(session_id, workspace)
-        send_event("pages_discovered", structure)
+        await send_pages_if_changed()
         
         # Listen for additional prompts
-        print(f"[Sandbox:{session_id}] Ready for additional prompts (WebSocket is open for new messages)...")
+        logger.info("[Sandbox:%s] Ready for additional prompts (WebSocket is open for new messages)...", session_id)
         while True:
             try:
-                # Check for new prompts every 0.5 seconds
-                new_prompt = None
-                try:
-                    new_prompt = prompt_queue.get(timeout=0.5)
-                except queue.Empty:
-                    continue
+                new_prompt = await prompt_queue.get()
                 
                 if new_prompt:
                     turn_count += 1
-                    print(f"[Sandbox:{session_id}] Processing turn {turn_count}")
+                    logger.info("[Sandbox:%s] Processing turn %s", session_id, turn_count)
                     await process_prompt(new_prompt, turn_count)
                     
                     # Send updated structure after each turn
-                    structure = scan_workspace_pages(session_id, workspace)
-                    send_event("pages_discovered", structure)
+                    await send_pages_if_changed()
                     
                     send_event("ready_for_input", {"turn": turn_count})
                     
             except asyncio.CancelledError:
-                print(f"[Sandbox:{session_id}] Agent loop cancelled")
+                logger.info("[Sandbox:%s] Agent loop cancelled", session_id)
                 break
             except Exception as e:
-                print(f"[Sandbox:{session_id}] Error in agent loop: {type(e).__name__}: {e}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("[Sandbox:%s] Error in agent loop: %s: %s", session_id, type(e).__name__, e)
                 break
     
-    print(f"[Sandbox:{session_id}] Claude SDK completed ({total_event_count} total messages, {turn_count} turns)")
+    logger.info("[Sandbox:%s] Claude SDK completed (%s total messages, %s turns)", session_id, total_event_count, turn_count)
     
     return {
         "event_count": total_event_count,
@@ -476,6 +746,18 @@ The file must be saved as index.html in the current directory ({workspace})."""
     }
 
 
+async def update_session(session_id: str, **fields) -> bool:
+    """Apply a status transition to the stored session in one get/put; False if the session is gone"""
+    # Async Dict calls, since this runs on the loop that also serves the WebSocket clients
+    session_data = await sessions.get.aio(session_id)
+    if session_data is None:
+        return False
+    session_data.update(fields)
+    session_data["last_activity"] = now_iso()
+    await sessions.put.aio(session_id, session_data)
+    return True
+
+
 @app.function(
     image=agent_image,
     secrets=[modal.Secret.from_name("anthropic-secret")],
@@ -483,83 +765,109 @@ The file must be saved as index.html in the current directory ({workspace})."""
 )
 async def run_agent_in_sandbox(session_id: str, prompt: str):
     """Main function to run Claude Agent in Modal sandbox with WebSocket streaming and multi-turn support"""
+    configure_logging()
     
-    print(f"[Sandbox:{session_id}] Starting agent in sandbox")
-    print(f"[Sandbox:{session_id}] Initial prompt: {prompt[:100]}..." if len(prompt) > 100 else f"[Sandbox:{session_id}] Initial prompt: {prompt}")
+    logger.info("[Sandbox:%s] Starting agent in sandbox", session_id)
+    logger.info("[Sandbox:%s] Initial prompt: %s", session_id, prompt[:100] + "..." if len(prompt) > 100 else prompt)
     
     # Setup event queue, prompt queue, and send_event function
-    event_queue = queue.Queue()
-    prompt_queue = queue.Queue()
-    send_event = send_event_factory(session_id, event_queue)
+    # The WebSocket server shares this function's event loop
+    event_queue = asyncio.Queue(maxsize=MAX_QUEUED_EVENTS)
+    prompt_queue = asyncio.Queue()
+    send_event, send_events = send_event_factory(session_id, event_queue, asyncio.get_running_loop())
     
     # Setup workspace
-    workspace = setup_workspace(session_id)
+    workspace = await asyncio.to_thread(setup_workspace, session_id)
     
     results = {
         "status": "started",
         "session_id": session_id,
         "workspace": workspace,
-        "events": [],
         "websocket_url": None
     }
     
     # Start WebSocket server
-    run_websocket_server = setup_websocket_server(session_id, event_queue, prompt_queue)
-    ws_thread = threading.Thread(target=run_websocket_server, daemon=True)
-    ws_thread.start()
-    time.sleep(2)
-    print(f"[Sandbox:{session_id}] WebSocket server started")
+    logger.info("[Sandbox:%s] Starting WebSocket server on port 8080", session_id)
+    ws_server = setup_websocket_server(session_id, event_queue, prompt_queue)
+    ws_task = asyncio.create_task(ws_server.serve())
+    await ws_server.startup_done.wait()
+    logger.info("[Sandbox:%s] WebSocket server started", session_id)
     
-    with modal.forward(3000) as dev_tunnel, modal.forward(8080) as ws_tunnel:
+    async def stop_websocket_server():
+        """Stop the embedded server, cancelling it if its connections do not close in time"""
+        if ws_task.done():
+            return
+        ws_server.should_exit = True
+        done, _ = await asyncio.wait({ws_task}, timeout=WS_SHUTDOWN_TIMEOUT)
+        if not done:
+            logger.warning("[Sandbox:%s] WebSocket server did not stop in %ss, cancelling", session_id, WS_SHUTDOWN_TIMEOUT)
+            ws_task.cancel()
+            await asyncio.gather(ws_task, return_exceptions=True)
+    
+    async def flush_events_and_stop():
+        """Let connected clients receive the final frames, then stop the server while the tunnel is still open"""
+        try:
+            await asyncio.wait_for(event_queue.join(), EVENT_FLUSH_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("[Sandbox:%s] %d event(s) undelivered at shutdown", session_id, event_queue.qsize())
+        await stop_websocket_server()
+    
+    async with contextlib.AsyncExitStack() as stack:
+        # Exit callbacks run in reverse: this one still stops the server if a tunnel fails to open
+        stack.push_async_callback(stop_websocket_server)
+        
+        # Open both tunnels concurrently rather than one after the other
+        dev_tunnel, ws_tunnel = await asyncio.gather(
+            stack.enter_async_context(modal.forward.aio(3000)),
+            stack.enter_async_context(modal.forward.aio(8080))
+        )
+        # Runs before the tunnels close
+        stack.push_async_callback(flush_events_and_stop)
         dev_tunnel_url = dev_tunnel.url
         ws_tunnel_url = ws_tunnel.url.replace('https://', 'wss://').replace('http://', 'ws://') + '/ws'
         
         # Check if URL is changing (shouldn't happen for same session)
-        existing_ws_url = ws_urls.get(session_id)
+        existing_ws_url = await ws_urls.get.aio(session_id)
         if existing_ws_url and existing_ws_url != ws_tunnel_url:
-            print(f"[Sandbox:{session_id}] WARNING: WebSocket URL changed!")
-            print(f"[Sandbox:{session_id}]   Old: {existing_ws_url}")
-            print(f"[Sandbox:{session_id}]   New: {ws_tunnel_url}")
+            logger.warning("[Sandbox:%s] WARNING: WebSocket URL changed!", session_id)
+            logger.warning("[Sandbox:%s]   Old: %s", session_id, existing_ws_url)
+            logger.warning("[Sandbox:%s]   New: %s", session_id, ws_tunnel_url)
         
-        ws_urls[session_id] = ws_tunnel_url
+        await ws_urls.put.aio(session_id, ws_tunnel_url)
+        
+        logger.info("[Sandbox:%s] Modal dev tunnel created: %s", session_id, dev_tunnel_url)
+        logger.info("[Sandbox:%s] Modal websocket tunnel created: %s", session_id, ws_tunnel_url)
+        
+        # Started after the first turn; stopped (with its monitor) before events are flushed
+        dev_server = DevServerManager(
+            session_id=session_id,
+            work_dir=workspace,
+            dev_tunnel_url=dev_tunnel_url,
+            ws_tunnel_url=ws_tunnel_url,
+            send_event=send_event
+        )
+        stack.push_async_callback(dev_server.stop)
         
-        print(f"[Sandbox:{session_id}] Modal dev tunnel created: {dev_tunnel_url}")
-        print(f"[Sandbox:{session_id}] Modal websocket tunnel created: {ws_tunnel_url}")
+        # Update session with tunnel URLs and running status in one write
+        if await update_session(session_id, status="running", dev_url=dev_tunnel_url, websocket_url=ws_tunnel_url):
+            logger.info("[Sandbox:%s] Updated session with WebSocket URL, status running", session_id)
         
-        # Update session data with WebSocket URL
-        if sessions.contains(session_id):
-            session_data = sessions[session_id]
-            session_data["websocket_url"] = ws_tunnel_url
-            session_data["last_activity"] = datetime.utcnow().isoformat()
-            sessions[session_id] = session_data
-            print(f"[Sandbox:{session_id}] Updated session with WebSocket URL")
+        async def record_error(status: str, error: str, error_type: str):
+            """Persist a failed session status and report the error to clients"""
+            results["status"] = status
+            await update_session(session_id, status=status, websocket_url=ws_tunnel_url, dev_url=dev_tunnel_url)
+            
+            send_event("agent_error", {"error": error, "error_type": error_type})
         
         # Send WebSocket URL as an event
         send_event("websocket_ready", {
             "websocket_url": ws_tunnel_url,
             "session_id": session_id
         })
-        time.sleep(1)
         
         try:
-            event_data = {
-                "type": "agent_coding_started",
-                "timestamp": datetime.utcnow().isoformat(),
-                "prompt": prompt
-            }
-            results["events"].append(event_data)
             send_event("coding_start", {"prompt": prompt, "work_dir": workspace})
             
-            # Update session status to running
-            if sessions.contains(session_id):
-                session_data = sessions[session_id]
-                session_data["status"] = "running"
-                session_data["last_activity"] = datetime.utcnow().isoformat()
-                session_data["dev_url"] = dev_tunnel_url
-                session_data["websocket_url"] = ws_tunnel_url
-                sessions[session_id] = session_data
-                print(f"[Sandbox:{session_id}] Updated session status to running")
-            
             # Run Claude Agent with multi-turn support (this runs indefinitely)
             # Dev server will be started after first turn completes
             try:
@@ -568,96 +876,48 @@ async def run_agent_in_sandbox(session_id: str, prompt: str):
                     initial_prompt=prompt,
                     workspace=workspace,
                     send_event=send_event,
+                    send_events=send_events,
                     prompt_queue=prompt_queue,
-                    dev_tunnel_url=dev_tunnel_url,
-                    ws_tunnel_url=ws_tunnel_url
+                    dev_server=dev_server
                 )
                 event_count = agent_results["event_count"]
                 turn_count = agent_results["turn_count"]
                 exit_code = agent_results["exit_code"]
                 
-                print(f"[Sandbox:{session_id}] Agent completed all turns successfully")
+                logger.info("[Sandbox:%s] Agent completed all turns successfully", session_id)
                 
             except Exception as sdk_error:
-                print(f"[Sandbox:{session_id}] Claude SDK error: {type(sdk_error).__name__}: {sdk_error}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("[Sandbox:%s] Claude SDK error: %s: %s", session_id, type(sdk_error).__name__, sdk_error)
                 exit_code = 1
                 event_count = 0
                 turn_count = 0
             
             # This code will only execute if the agent loop ends
-            event_data = {
-                "type": "agent_session_ended",
-                "timestamp": datetime.utcnow().isoformat(),
-                "exit_code": exit_code,
-                "turn_count": turn_count
-            }
-            results["events"].append(event_data)
             send_event("session_end", {"exit_code": exit_code, "turn_count": turn_count})
             
             results["event_count"] = event_count
             results["turn_count"] = turn_count
             results["exit_code"] = exit_code
             results["status"] = "completed"
-            print(f"[Sandbox:{session_id}] Agent session ended ({turn_count} turns, {event_count} events)")
+            logger.info("[Sandbox:%s] Agent session ended (%s turns, %s events)", session_id, turn_count, event_count)
             
             # Update session status
-            if sessions.contains(session_id):
-                session_data = sessions[session_id]
-                session_data["status"] = "completed"
-                session_data["last_activity"] = datetime.utcnow().isoformat()
-                sessions[session_id] = session_data
-                print(f"[Sandbox:{session_id}] Updated session status to completed")
+            if await update_session(session_id, status="completed"):
+                logger.info("[Sandbox:%s] Updated session status to completed", session_id)
             
             send_event("agent_complete", {"status": "completed"})
-            print(f"[Sandbox:{session_id}] Sandbox shutting down")
-            
-        except subprocess.TimeoutExpired:
-            print(f"[Sandbox:{session_id}] ERROR: Execution timeout")
-            results["status"] = "timeout"
+            logger.info("[Sandbox:%s] Sandbox shutting down", session_id)
             
-            if sessions.contains(session_id):
-                session_data = sessions[session_id]
-                session_data["status"] = "timeout"
-                session_data["last_activity"] = datetime.utcnow().isoformat()
-                if ws_urls.contains(session_id):
-                    session_data["websocket_url"] = ws_urls[session_id]
-                    session_data["dev_url"] = dev_tunnel_url
-                sessions[session_id] = session_data
-            
-            event_data = {
-                "type": "agent_error",
-                "timestamp": datetime.utcnow().isoformat(),
-                "error": "Execution timeout"
-            }
-            results["events"].append(event_data)
-            send_event("agent_error", {"error": "Execution timeout", "error_type": "timeout"})
+        except TimeoutError:
+            # asyncio timeouts (asyncio.TimeoutError is TimeoutError) from the agent/SDK calls
+            logger.error("[Sandbox:%s] ERROR: Execution timeout", session_id)
+            await record_error("timeout", "Execution timeout", "timeout")
             
         except Exception as e:
-            print(f"[Sandbox:{session_id}] ERROR: {type(e).__name__}: {e}")
-            import traceback
-            traceback.print_exc()
-            results["status"] = "error"
+            logger.exception("[Sandbox:%s] ERROR: %s: %s", session_id, type(e).__name__, e)
             results["error"] = str(e)
-            
-            if sessions.contains(session_id):
-                session_data = sessions[session_id]
-                session_data["status"] = "error"
-                session_data["last_activity"] = datetime.utcnow().isoformat()
-                if ws_urls.contains(session_id):
-                    session_data["websocket_url"] = ws_urls[session_id]
-                    session_data["dev_url"] = dev_tunnel_url
-                sessions[session_id] = session_data
-            
-            event_data = {
-                "type": "agent_error",
-                "timestamp": datetime.utcnow().isoformat(),
-                "error": str(e)
-            }
-            results["events"].append(event_data)
-            send_event("agent_error", {"error": str(e), "error_type": type(e).__name__})
+            await record_error("error", str(e), type(e).__name__)
         
-        print(f"[Sandbox:{session_id}] Returning results with status: {results['status']}")
+        logger.info("[Sandbox:%s] Returning results with status: %s", session_id, results['status'])
         return results
 
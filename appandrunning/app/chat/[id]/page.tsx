@@ -44,212 +44,219 @@ export default function ChatPage() {
   }, [messages]);
 
   // Watch for websocket events
+  const processedEventsRef = useRef(0);
   useEffect(() => {
-    if (!agentSession.events.length) return;
-
-    const latestEvent = agentSession.events[agentSession.events.length - 1];
-    console.log('[Chat] Processing event:', latestEvent.event, latestEvent.data);
+    // Events can arrive in batches, so handle everything since the last run
+    if (agentSession.events.length < processedEventsRef.current) {
+      processedEventsRef.current = 0;
+    }
+    const newEvents = agentSession.events.slice(processedEventsRef.current);
+    processedEventsRef.current = agentSession.events.length;
+
+    for (const event of newEvents) {
+      console.log('[Chat] Processing event:', event.event, event.data);
+
+      // Handle Claude text events
+      if (event.event === "claude_text") {
+        const text = event.data?.text;
+        if (text) {
+          console.log('[Chat] Got text:', text.substring(0, 50));
+          // Don't hide thinking yet - Claude might be thinking/using tools after text
+          setMessages((prev) => {
+            const streamingMsgId = "streaming-response";
+            const existingIndex = prev.findIndex((m) => m.id === streamingMsgId);
+
+            if (existingIndex >= 0) {
+              const updated = [...prev];
+              updated[existingIndex] = {
+                ...updated[existingIndex],
+                content: updated[existingIndex].content + text,
+              };
+              return updated;
+            } else {
+              // Remove placeholder "Building..." messages when real content arrives
+              const filtered = prev.filter(m =>
+                !m.content.includes("Building your website") &&
+                !m.content.includes("Processing your request")
+              );
+              return [
+                ...filtered,
+                {
+                  id: streamingMsgId,
+                  role: "assistant",
+                  content: text,
+                  timestamp: new Date(),
+                },
+              ];
+            }
+          });
+          // Show thinking after text (Claude might be thinking about next steps)
+          setIsThinking(true);
+        }
+      }
 
-    // Handle Claude text events
-    if (latestEvent.event === "claude_text") {
-      const text = latestEvent.data?.text;
-      if (text) {
-        console.log('[Chat] Got text:', text.substring(0, 50));
-        // Don't hide thinking yet - Claude might be thinking/using tools after text
-        setMessages((prev) => {
-          const streamingMsgId = "streaming-response";
-          const existingIndex = prev.findIndex((m) => m.id === streamingMsgId);
-
-          if (existingIndex >= 0) {
-            const updated = [...prev];
-            updated[existingIndex] = {
-              ...updated[existingIndex],
-              content: updated[existingIndex].content + text,
-            };
-            return updated;
-          } else {
-            // Remove placeholder "Building..." messages when real content arrives
-            const filtered = prev.filter(m =>
-              !m.content.includes("Building your website") &&
-              !m.content.includes("Processing your request")
-            );
-            return [
-              ...filtered,
-              {
-                id: streamingMsgId,
-                role: "assistant",
-                content: text,
-                timestamp: new Date(),
-              },
-            ];
-          }
-        });
-        // Show thinking after text (Claude might be thinking about next steps)
+      // Handle Claude thinking events
+      if (event.event === "claude_thinking") {
+        console.log('[Chat] Claude is thinking');
         setIsThinking(true);
       }
-    }
-
-    // Handle Claude thinking events
-    if (latestEvent.event === "claude_thinking") {
-      console.log('[Chat] Claude is thinking');
-      setIsThinking(true);
-    }
 
-    // Handle Claude tool use events
-    if (latestEvent.event === "claude_tool_use") {
-      console.log('[Chat] Claude is using a tool:', latestEvent.data?.tool);
-      setIsThinking(true);
-    }
+      // Handle Claude tool use events
+      if (event.event === "claude_tool_use") {
+        console.log('[Chat] Claude is using a tool:', event.data?.tool);
+        setIsThinking(true);
+      }
 
-    // Handle Claude events (contains text in nested structure)
-    if (latestEvent.event === "claude_event") {
-      const eventType = latestEvent.data?.event_type;
-      const data = latestEvent.data?.data;
-
-      console.log('[Chat] Claude event type:', eventType);
-
-      // Extract text from message content
-      if (data?.message?.content && Array.isArray(data.message.content)) {
-        for (const item of data.message.content) {
-          if (item.type === "text" && item.text) {
-            console.log('[Chat] Got text from content:', item.text.substring(0, 50));
-            setMessages((prev) => {
-              const streamingMsgId = "streaming-response";
-              const existingIndex = prev.findIndex((m) => m.id === streamingMsgId);
-
-              if (existingIndex >= 0) {
-                const updated = [...prev];
-                updated[existingIndex] = {
-                  ...updated[existingIndex],
-                  content: updated[existingIndex].content + item.text,
-                };
-                return updated;
-              } else {
-                // Remove placeholder messages when real content arrives
-                const filtered = prev.filter(m =>
-                  !m.content.includes("Building your website") &&
-                  !m.content.includes("Processing your request")
-                );
-                return [
-                  ...filtered,
-                  {
-                    id: streamingMsgId,
-                    role: "assistant",
-                    content: item.text,
-                    timestamp: new Date(),
-                  },
-                ];
-              }
-            });
+      // Handle Claude events (contains text in nested structure)
+      if (event.event === "claude_event") {
+        const eventType = event.data?.event_type;
+        const data = event.data?.data;
+
+        console.log('[Chat] Claude event type:', eventType);
+
+        // Extract text from message content
+        if (data?.message?.content && Array.isArray(data.message.content)) {
+          for (const item of data.message.content) {
+            if (item.type === "text" && item.text) {
+              console.log('[Chat] Got text from content:', item.text.substring(0, 50));
+              setMessages((prev) => {
+                const streamingMsgId = "streaming-response";
+                const existingIndex = prev.findIndex((m) => m.id === streamingMsgId);
+
+                if (existingIndex >= 0) {
+                  const updated = [...prev];
+                  updated[existingIndex] = {
+                    ...updated[existingIndex],
+                    content: updated[existingIndex].content + item.text,
+                  };
+                  return updated;
+                } else {
+                  // Remove placeholder messages when real content arrives
+                  const filtered = prev.filter(m =>
+                    !m.content.includes("Building your website") &&
+                    !m.content.includes("Processing your request")
+                  );
+                  return [
+                    ...filtered,
+                    {
+                      id: streamingMsgId,
+                      role: "assistant",
+                      content: item.text,
+                      timestamp: new Date(),
+                    },
+                  ];
+                }
+              });
+            }
           }
         }
       }
-    }
 
-    // Handle dev server started
-    if (latestEvent.event === "dev_server_started") {
-      const url = latestEvent.data?.tunnel_url;
-      if (url && !devUrl) {
-        console.log('[Chat] Dev server started:', url);
-        setDevUrl(url);
+      // Handle dev server started
+      if (event.event === "dev_server_started") {
+        const url = event.data?.tunnel_url;
+        if (url && !devUrl) {
+          console.log('[Chat] Dev server started:', url);
+          setDevUrl(url);
+
+          const msg: Message = {
+            id: `website-ready-${Date.now()}`,
+            role: "assistant",
+            content: "✨ Your website is ready! Check it out in the preview panel on the right.",
+            timestamp: new Date(),
+          };
+
+          setMessages((prev) => {
+            const exists = prev.some((m) => m.content.includes("website is ready"));
+            return exists ? prev : [...prev, msg];
+          });
+
+          // Initial load of iframe
+          console.log('[Chat] Initial iframe load');
+          setIframeRefreshTrigger(prev => prev + 1);
+        }
+      }
 
-        const msg: Message = {
-          id: `website-ready-${Date.now()}`,
-          role: "assistant",
-          content: "✨ Your website is ready! Check it out in the preview panel on the right.",
-          timestamp: new Date(),
-        };
+      // Handle turn complete - finalize streaming message for this turn
+      if (event.event === "turn_complete") {
+        console.log('[Chat] Turn completed');
+        setIsThinking(false);
 
+        // Finalize streaming message for this turn
         setMessages((prev) => {
-          const exists = prev.some((m) => m.content.includes("website is ready"));
-          return exists ? prev : [...prev, msg];
+          const hasStreaming = prev.some(m => m.id === "streaming-response");
+          if (!hasStreaming) return prev;
+
+          return prev.map((msg) => {
+            if (msg.id === "streaming-response") {
+              return {
+                ...msg,
+                id: `response-${Date.now()}`,
+              };
+            }
+            return msg;
+          });
         });
 
-        // Initial load of iframe
-        console.log('[Chat] Initial iframe load');
-        setIframeRefreshTrigger(prev => prev + 1);
+        // Refresh iframe to show updated website
+        if (devUrl) {
+          console.log('[Chat] Refreshing iframe after turn complete');
+          setIframeRefreshTrigger(prev => prev + 1);
+        }
       }
-    }
-
-    // Handle turn complete - finalize streaming message for this turn
-    if (latestEvent.event === "turn_complete") {
-      console.log('[Chat] Turn completed');
-      setIsThinking(false);
 
-      // Finalize streaming message for this turn
-      setMessages((prev) => {
-        const hasStreaming = prev.some(m => m.id === "streaming-response");
-        if (!hasStreaming) return prev;
-
-        return prev.map((msg) => {
-          if (msg.id === "streaming-response") {
-            return {
-              ...msg,
-              id: `response-${Date.now()}`,
-            };
-          }
-          return msg;
-        });
-      });
+      // Handle ready for input
+      if (event.event === "ready_for_input") {
+        console.log('[Chat] Ready for input');
+        setIsThinking(false);
 
-      // Refresh iframe to show updated website
-      if (devUrl) {
-        console.log('[Chat] Refreshing iframe after turn complete');
-        setIframeRefreshTrigger(prev => prev + 1);
+        // Also refresh iframe when ready for input
+        if (devUrl) {
+          console.log('[Chat] Refreshing iframe - ready for input');
+          setIframeRefreshTrigger(prev => prev + 1);
+        }
       }
-    }
-
-    // Handle ready for input
-    if (latestEvent.event === "ready_for_input") {
-      console.log('[Chat] Ready for input');
-      setIsThinking(false);
 
-      // Also refresh iframe when ready for input
-      if (devUrl) {
-        console.log('[Chat] Refreshing iframe - ready for input');
-        setIframeRefreshTrigger(prev => prev + 1);
+      // Handle pages discovered
+      if (event.event === "pages_discovered") {
+        console.log('[Chat] Pages discovered:', event.data);
+        setWebsitePages(event.data as PageStructure);
       }
-    }
 
-    // Handle pages discovered
-    if (latestEvent.event === "pages_discovered") {
-      console.log('[Chat] Pages discovered:', latestEvent.data);
-      setWebsitePages(latestEvent.data as PageStructure);
-    }
+      // Handle agent complete
+      if (event.event === "agent_complete") {
+        console.log('[Chat] Agent completed');
 
-    // Handle agent complete
-    if (latestEvent.event === "agent_complete") {
-      console.log('[Chat] Agent completed');
-
-      // Finalize streaming message
-      setMessages((prev) => {
-        return prev.map((msg) => {
-          if (msg.id === "streaming-response") {
-            return {
-              ...msg,
-              id: `response-${Date.now()}`,
-            };
-          }
-          return msg;
+        // Finalize streaming message
+        setMessages((prev) => {
+          return prev.map((msg) => {
+            if (msg.id === "streaming-response") {
+              return {
+                ...msg,
+                id: `response-${Date.now()}`,
+              };
+            }
+            return msg;
+          });
         });
-      });
 
-      setIsLoading(false);
-      setIsThinking(false);
-    }
+        setIsLoading(false);
+        setIsThinking(false);
+      }
 
-    // Handle errors
-    if (latestEvent.event === "agent_error") {
-      console.log('[Chat] Agent error:', latestEvent.data?.error);
-      const errorMsg: Message = {
-        id: `error-${Date.now()}`,
-        role: "assistant",
-        content: `I encountered an error: ${latestEvent.data?.error || "Unknown error"}. Please try again.`,
-        timestamp: new Date(),
-      };
-      setMessages((prev) => [...prev, errorMsg]);
-      setIsLoading(false);
-      setIsThinking(false);
+      // Handle errors
+      if (event.event === "agent_error") {
+        console.log('[Chat] Agent error:', event.data?.error);
+        const errorMsg: Message = {
+          id: `error-${Date.now()}`,
+          role: "assistant",
+          content: `I encountered an error: ${event.data?.error || "Unknown error"}. Please try again.`,
+          timestamp: new Date(),
+        };
+        setMessages((prev) => [...prev, errorMsg]);
+        setIsLoading(false);
+        setIsThinking(false);
+      }
     }
   }, [agentSession.events, devUrl]);
 
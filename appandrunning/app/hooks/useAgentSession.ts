@@ -35,12 +35,12 @@ export function useAgentSession(sessionId: string | null) {
   const reconnectAttemptsRef = useRef(0);
   const shouldReconnectRef = useRef(true);
 
-  const handleMessage = useCallback((event: AgentEvent, sendFn: (prompt: string) => boolean) => {
-    console.log('[WebSocket] Received event:', event.event);
+  const handleMessage = useCallback((events: AgentEvent[], sendFn: (prompt: string) => boolean) => {
+    console.log('[WebSocket] Received events:', events.map((e) => e.event).join(', '));
     setState((prev) => ({
       ...prev,
-      events: [...prev.events, event],
-      status: event.data?.status || prev.status,
+      events: [...prev.events, ...events],
+      status: events.reduce((status, e) => e.data?.status || status, prev.status),
       sendPrompt: sendFn,
     }));
 
@@ -134,7 +134,8 @@ export function useAgentSession(sessionId: string | null) {
       ws.onmessage = (event) => {
         try {
           const data = JSON.parse(event.data);
-          handleMessage(data, sendPrompt);
+          // Bursts of events arrive coalesced as {"batch": [...]}
+          handleMessage(data.batch ?? [data], sendPrompt);
         } catch (error) {
           console.error('[WebSocket] Failed to parse message:', error);
         }
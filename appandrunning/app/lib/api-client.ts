@@ -94,7 +94,7 @@ export class APIClient {
   }
 
   /**
-   * List all sessions
+   * List all sessions (records carry no message history; it is stored separately)
    */
   async listSessions(): Promise<{ sessions: SessionStatus[]; total: number }> {
     const response = await fetch(`${this.baseUrl}/api/sessions`);
@@ -139,7 +139,10 @@ export class APIClient {
     ws.onmessage = (event) => {
       try {
         const data = JSON.parse(event.data);
-        onMessage(data);
+        // Bursts of events arrive coalesced as {"batch": [...]}
+        for (const agentEvent of data.batch ?? [data]) {
+          onMessage(agentEvent);
+        }
       } catch (error) {
         console.error('Failed to parse WebSocket message:', error);
       }
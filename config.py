@@ -2,6 +2,13 @@
 Modal configuration and image setup
 """
 
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
 import modal
 
 # Create Modal app
@@ -15,7 +22,8 @@ agent_image = (
         "curl -fsSL https://deb.nodesource.com/setup_22.x | bash -",
         "apt-get install -y nodejs"
     )
-    .run_commands("npm install -g pnpm")
+    # serve is preinstalled so dev server starts don't resolve/download it via npx
+    .run_commands("npm install -g pnpm serve")
     .pip_install_from_requirements("requirements.txt")
     .run_commands(
         "useradd -m -s /bin/bash -u 1000 claudeuser",
@@ -29,9 +37,36 @@ agent_image = (
     .run_commands(
         "su - claudeuser -c 'curl -fsSL https://claude.ai/install.sh | bash'"
     )
-    .add_local_python_source("config", "models", "routes", "dev_server", "agent")
+    .add_local_python_source("config", "models", "routes", "dev_server", "agent", "timestamps")
 )
 
+# Loggers owned by this app; third-party libraries stay at WARNING
+APP_LOGGERS = ("routes", "sandbox")
+
+
+# Background writer draining log records to stdout, started by configure_logging()
+_log_listener = None
+
+
+def configure_logging():
+    """Send application log records to stdout via a queue; level comes from LOGLEVEL (default INFO)"""
+    global _log_listener
+    if _log_listener is None:
+        # Callers only enqueue; the stdout write and flush happen on the listener thread
+        log_queue = queue.SimpleQueue()
+        # Records arrive already formatted by the QueueHandler
+        _log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+        _log_listener.start()
+        atexit.register(_log_listener.stop)
+        logging.basicConfig(level=logging.WARNING, format="%(message)s", handlers=[logging.handlers.QueueHandler(log_queue)])
+    level = os.environ.get("LOGLEVEL", "INFO").upper()
+    for name in APP_LOGGERS:
+        logging.getLogger(name).setLevel(level)
+
+
 # Create Modal Dicts for persistent storage
 sessions = modal.Dict.from_name("sessions", create_if_missing=True)
 ws_urls = modal.Dict.from_name("ws_urls", create_if_missing=True)
+# Chat history, one queue partition per session: a turn appends only its own message
+# and deleting a session clears its partition in one call
+session_messages = modal.Queue.from_name("session-messages", create_if_missing=True)
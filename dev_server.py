@@ -2,14 +2,37 @@
 Development server manager for running and monitoring HTTP server
 """
 
+import asyncio
+import logging
 import os
+import pwd
+import select
+import socket
 import subprocess
-import threading
 import time
-import glob
 from typing import Optional, Callable
-from urllib.request import urlopen
-from urllib.error import URLError, HTTPError
+
+# Same logger as agent.py, so the sandbox's LOGLEVEL applies here too
+logger = logging.getLogger("sandbox")
+
+# Seconds between liveness probes while the server process stays up (exits are seen immediately)
+HEALTH_CHECK_INTERVAL = 30
+
+# Seconds before retrying after a failed restart, doubling per consecutive failure up to the cap
+RESTART_BACKOFF_MIN = 10
+RESTART_BACKOFF_MAX = 300
+
+# Literal loopback address probed by health checks (skips the resolver for "localhost")
+DEV_SERVER_ADDRESS = ("127.0.0.1", 3000)
+
+# Bytes read from the end of the server log when printing its last lines
+LOG_TAIL_BYTES = 8192
+
+# Unprivileged account the server runs as, resolved once (None outside the agent image)
+try:
+    CLAUDE_USER = pwd.getpwnam('claudeuser')
+except KeyError:
+    CLAUDE_USER = None
 
 
 class DevServerManager:
@@ -22,116 +45,127 @@ class DevServerManager:
         self.ws_tunnel_url = ws_tunnel_url
         self.send_event = send_event
         self.process: Optional[subprocess.Popen] = None
-        self.lock = threading.Lock()
-        self.monitor_running = threading.Event()
+        self.monitor_running = asyncio.Event()
         self.monitor_running.set()
+        self.monitor_task: Optional[asyncio.Task] = None
+        # Restart running in a worker thread, shielded so stop() can still collect its process
+        self.pending_start: Optional[asyncio.Future] = None
     
-    def check_health(self, timeout: int = 5, verbose: bool = False) -> bool:
-        """Health check - verify server is responding"""
+    def check_health(self, timeout: float = 0.5, verbose: bool = False) -> bool:
+        """Health check - verify server is accepting connections"""
         try:
-            # Check if server responds at root path
-            request_obj = urlopen(f"http://localhost:3000/", timeout=timeout)
-            response_code = request_obj.getcode()
-            
-            if verbose:
-                print(f"[Sandbox:{self.session_id}] Health check: server responded with {response_code}")
-            
-            # Server is healthy if it responds at all
-            return True
+            # A completed TCP handshake is enough to know the server is up
+            with socket.create_connection(DEV_SERVER_ADDRESS, timeout=timeout):
+                pass
             
-        except HTTPError as e:
-            # HTTPError means server responded with an error code - server IS running!
             if verbose:
-                print(f"[Sandbox:{self.session_id}] Health check: server responded with {e.code}")
+                logger.info("[Sandbox:%s] Health check: server accepted connection", self.session_id)
             return True
             
-        except URLError as e:
-            # URLError (connection refused) means server isn't running yet
+        except OSError as e:
+            # Connection refused or timed out means server isn't running yet
             if verbose:
-                print(f"[Sandbox:{self.session_id}] Health check: connection refused (server not ready)")
+                logger.info("[Sandbox:%s] Health check: %s (server not ready)", self.session_id, type(e).__name__)
             return False
-            
-        except Exception as e:
-            if verbose:
-                print(f"[Sandbox:{self.session_id}] Health check exception: {type(e).__name__}: {e}")
+    
+    async def check_health_async(self, timeout: float = 0.5) -> bool:
+        """Health check for the monitor task, connecting without blocking the event loop"""
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(*DEV_SERVER_ADDRESS), timeout)
+        except (OSError, asyncio.TimeoutError):
             return False
+        writer.close()
+        return True
     
     def start(self) -> Optional[subprocess.Popen]:
-        """Start the development server"""
-        self.send_event("dev_server_starting", {})
-        print(f"[Sandbox:{self.session_id}] Starting simple HTTP server in {self.work_dir}")
+        """Start the development server (callers announce dev_server_starting/restarting themselves)"""
+        logger.info("[Sandbox:%s] Starting simple HTTP server in %s", self.session_id, self.work_dir)
         
-        # Check what files exist in the workspace
-        files = glob.glob(f"{self.work_dir}/*")
-        print(f"[Sandbox:{self.session_id}] Files in workspace: {len(files)} files")
-        for file in files[:10]:  # Show first 10 files
-            file_name = os.path.basename(file)
-            file_size = os.path.getsize(file) if os.path.isfile(file) else 0
-            print(f"[Sandbox:{self.session_id}]   - {file_name} ({file_size} bytes)")
+        # Check what files exist in the workspace (only the first 10 shown are stat'ed)
+        file_count = 0
+        shown_files = []
+        with os.scandir(self.work_dir) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                file_count += 1
+                if len(shown_files) < 10:
+                    shown_files.append((entry.name, entry.stat().st_size if entry.is_file() else 0))
+        logger.info("[Sandbox:%s] Files in workspace: %d files", self.session_id, file_count)
+        for file_name, file_size in shown_files:
+            logger.info("[Sandbox:%s]   - %s (%d bytes)", self.session_id, file_name, file_size)
         
         # Check specifically for index.html
-        index_path = os.path.join(self.work_dir, "index.html")
-        if os.path.exists(index_path):
-            file_size = os.path.getsize(index_path)
-            print(f"[Sandbox:{self.session_id}] ✓ index.html found ({file_size} bytes)")
+        try:
+            index_size = os.stat(os.path.join(self.work_dir, "index.html")).st_size
+        except FileNotFoundError:
+            index_size = None
+        if index_size is not None:
+            logger.info("[Sandbox:%s] ✓ index.html found (%d bytes)", self.session_id, index_size)
         else:
-            print(f"[Sandbox:{self.session_id}] ✗ index.html NOT found in {self.work_dir}")
-            print(f"[Sandbox:{self.session_id}] WARNING: Starting server anyway, but preview may not work")
+            logger.warning("[Sandbox:%s] ✗ index.html NOT found in %s", self.session_id, self.work_dir)
+            logger.warning("[Sandbox:%s] WARNING: Starting server anyway, but preview may not work", self.session_id)
         
         log_path = f"/tmp/dev_server_{self.session_id}.log"
         try:
-            import pwd
-            claude_user = pwd.getpwnam('claudeuser')
-            
-            def demote():
-                """Demote privileges to run as claudeuser"""
-                os.setgid(claude_user.pw_gid)
-                os.setuid(claude_user.pw_uid)
-                os.environ['HOME'] = claude_user.pw_dir
-                os.environ['USER'] = 'claudeuser'
-                os.environ['LOGNAME'] = 'claudeuser'
+            claude_user = CLAUDE_USER
+            if claude_user is None:
+                raise KeyError("getpwnam(): name not found: 'claudeuser'")
             
-            # Start npx serve for static file serving
+            # Start the preinstalled serve binary for static file serving
             # WITHOUT -s flag so /pizza serves pizza.html, not index.html
             # -l flag sets the port
             # --no-port-switching prevents port changes if 3000 is busy
             # Note: If you need SPA mode, add -s flag back
+            # Privileges are dropped by Popen itself (user/group), so no Python code runs in the child
             with open(log_path, "w") as log_file:
                 process = subprocess.Popen(
-                    ["npx", "--yes", "serve@latest", "-l", "3000", "--no-port-switching"],
+                    ["serve", "-l", "3000", "--no-port-switching"],
                     cwd=self.work_dir,
                     stdout=log_file,
                     stderr=subprocess.STDOUT,
                     stdin=subprocess.DEVNULL,
-                    preexec_fn=demote,
-                    env={**os.environ, 'HOME': claude_user.pw_dir}
+                    user=claude_user.pw_uid,
+                    group=claude_user.pw_gid,
+                    env={
+                        **os.environ,
+                        'HOME': claude_user.pw_dir,
+                        'USER': claude_user.pw_name,
+                        'LOGNAME': claude_user.pw_name
+                    }
                 )
             
-            print(f"[Sandbox:{self.session_id}] HTTP server process started as claudeuser (PID: {process.pid}), log: {log_path}")
+            logger.info("[Sandbox:%s] HTTP server process started as claudeuser (PID: %s), log: %s", self.session_id, process.pid, log_path)
             
-            # Wait for server to be ready
-            for attempt in range(30):
+            # Wait for server to be ready, backing off from 10ms up to 500ms between probes
+            delay = 0.01
+            attempt = 0
+            deadline = time.monotonic() + 30
+            while time.monotonic() < deadline:
+                attempt += 1
                 if process.poll() is not None:
                     exit_code = process.returncode
                     error = f"Process exited with code {exit_code}"
-                    print(f"[Sandbox:{self.session_id}] {error}")
+                    logger.error("[Sandbox:%s] %s", self.session_id, error)
                     
                     self._print_log_file(log_path, 20)
                     self.send_event("dev_server_failed", {"error": error})
                     return None
                 
-                verbose = (attempt == 0 or attempt % 10 == 9)
-                if self.check_health(timeout=2, verbose=verbose):
-                    print(f"[Sandbox:{self.session_id}] Dev server health check passed (attempt {attempt + 1}/30)")
+                verbose = (attempt == 1 or attempt % 20 == 0)
+                if self.check_health(verbose=verbose):
+                    logger.info("[Sandbox:%s] Dev server health check passed (attempt %d)", self.session_id, attempt)
                     return process
                 
-                if attempt % 5 == 4:
-                    print(f"[Sandbox:{self.session_id}] Still waiting for dev server... (attempt {attempt + 1}/30)")
+                if attempt % 10 == 0:
+                    logger.info("[Sandbox:%s] Still waiting for dev server... (attempt %d)", self.session_id, attempt)
                 
-                time.sleep(1)
+                # Sleep on the process instead of the clock so an early crash is reported at once
+                self._wait_for_exit(process, delay)
+                delay = min(delay * 1.5, 0.5)
             
             # Health check timeout
-            print(f"[Sandbox:{self.session_id}] Health check timeout after 30 seconds")
+            logger.error("[Sandbox:%s] Health check timeout after 30 seconds", self.session_id)
             self._print_log_file(log_path, 30)
             
             if process.poll() is None:
@@ -147,26 +181,31 @@ class DevServerManager:
             
         except Exception as e:
             error = f"{type(e).__name__}: {e}"
-            print(f"[Sandbox:{self.session_id}] Error starting dev server: {error}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("[Sandbox:%s] Error starting dev server: %s", self.session_id, error)
             self.send_event("dev_server_failed", {"error": error})
             return None
     
     def _print_log_file(self, log_path: str, num_lines: int = 20):
         """Print the last N lines of the log file"""
         try:
-            with open(log_path, "r") as f:
-                log_content = f.read()
-                if log_content:
-                    print(f"[Sandbox:{self.session_id}] Last {num_lines} lines of log:")
-                    for line in log_content.split('\n')[-num_lines:]:
-                        if line.strip():
-                            print(f"[Sandbox:{self.session_id}]   {line}")
-                else:
-                    print(f"[Sandbox:{self.session_id}] Log file is empty")
+            # Only the tail is needed, however long the server has been logging
+            with open(log_path, "rb") as f:
+                size = f.seek(0, os.SEEK_END)
+                if size == 0:
+                    logger.info("[Sandbox:%s] Log file is empty", self.session_id)
+                    return
+                start = max(0, size - LOG_TAIL_BYTES)
+                f.seek(start)
+                lines = f.read().decode("utf-8", errors="replace").split('\n')
+            if start > 0:
+                # Drop the partial line the seek landed in
+                lines = lines[1:]
+            logger.info("[Sandbox:%s] Last %d lines of log:", self.session_id, num_lines)
+            for line in lines[-num_lines:]:
+                if line.strip():
+                    logger.info("[Sandbox:%s]   %s", self.session_id, line)
         except Exception as e:
-            print(f"[Sandbox:{self.session_id}] Could not read log file: {e}")
+            logger.warning("[Sandbox:%s] Could not read log file: %s", self.session_id, e)
     
     def _stop_process(self, process: Optional[subprocess.Popen]):
         """Stop a running process gracefully"""
@@ -177,45 +216,108 @@ class DevServerManager:
             except subprocess.TimeoutExpired:
                 process.kill()
             except Exception as e:
-                print(f"[Sandbox:{self.session_id}] Error stopping process: {e}")
+                logger.error("[Sandbox:%s] Error stopping process: %s", self.session_id, e)
     
-    def _monitor_loop(self):
+    def _wait_for_exit(self, process: subprocess.Popen, timeout: float) -> bool:
+        """Block until the process exits or the timeout elapses; returns True if it exited"""
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except (AttributeError, OSError):
+            # No pidfd support (or already reaped) - fall back to Popen's own wait
+            try:
+                process.wait(timeout=timeout)
+                return True
+            except subprocess.TimeoutExpired:
+                return False
+        try:
+            ready, _, _ = select.select([pidfd], [], [], timeout)
+            return bool(ready)
+        finally:
+            os.close(pidfd)
+    
+    async def _wait_for_exit_async(self, process: subprocess.Popen, timeout: float) -> bool:
+        """Wait on the event loop until the process exits or the timeout elapses; returns True if it exited"""
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except (AttributeError, OSError):
+            return await asyncio.to_thread(self._wait_for_exit, process, timeout)
+        loop = asyncio.get_running_loop()
+        exited = loop.create_future()
+        # The pidfd becomes readable once the process exits
+        loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(True))
+        try:
+            await asyncio.wait_for(exited, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            loop.remove_reader(pidfd)
+            os.close(pidfd)
+    
+    async def _monitor_loop(self):
         """Monitor the server and restart if needed"""
+        restart_delay = RESTART_BACKOFF_MIN
         while self.monitor_running.is_set():
-            time.sleep(10)
+            process = self.process
+            if process is None:
+                # The last restart failed - back off instead of retrying in a tight loop
+                await asyncio.sleep(restart_delay)
+                restart_delay = min(restart_delay * 2, RESTART_BACKOFF_MAX)
+            elif process.poll() is None:
+                # Wake as soon as the server exits; otherwise probe for hangs periodically
+                await self._wait_for_exit_async(process, HEALTH_CHECK_INTERVAL)
             
-            with self.lock:
-                process = self.process
-                is_unhealthy = (
-                    process is None or 
-                    process.poll() is not None or 
-                    not self.check_health(timeout=5)
-                )
+            # Only this task touches self.process after startup, and it reads and writes it
+            # between awaits on one loop, so the restart path needs no lock
+            process = self.process
+            is_unhealthy = (
+                process is None or 
+                process.poll() is not None or 
+                not await self.check_health_async()
+            )
+            
+            if is_unhealthy and self.monitor_running.is_set():
+                # The failure reason rides on the restarting event rather than a separate dev_server_error
+                restart_info = {}
+                if process and process.poll() is None:
+                    restart_info["error"] = "Server became unresponsive"
+                    logger.warning("[Sandbox:%s] Dev server unhealthy, restarting...", self.session_id)
+                    await asyncio.to_thread(self._stop_process, process)
                 
-                if is_unhealthy and self.monitor_running.is_set():
-                    if process and process.poll() is None:
-                        self.send_event("dev_server_error", {"error": "Server became unresponsive"})
-                        print(f"[Sandbox:{self.session_id}] Dev server unhealthy, restarting...")
-                        self._stop_process(process)
-                    
-                    self.send_event("dev_server_restarting", {})
-                    new_process = self.start()
-                    
-                    if new_process:
-                        self.process = new_process
-                        self.send_event("dev_server_restarted", {
-                            "tunnel_url": self.dev_tunnel_url,
-                            "websocket_url": self.ws_tunnel_url
-                        })
-                        print(f"[Sandbox:{self.session_id}] Dev server restarted successfully")
-                    else:
-                        print(f"[Sandbox:{self.session_id}] Failed to restart dev server")
+                self.send_event("dev_server_restarting", restart_info)
+                # start() blocks while it probes the new server, so it runs in a worker thread
+                self.pending_start = asyncio.ensure_future(asyncio.to_thread(self.start))
+                new_process = await asyncio.shield(self.pending_start)
+                self.pending_start = None
+                
+                # A failed start leaves None, so the next pass sleeps rather than waiting on a reaped process
+                self.process = new_process
+                if new_process:
+                    restart_delay = RESTART_BACKOFF_MIN
+                    self.send_event("dev_server_restarted", {
+                        "tunnel_url": self.dev_tunnel_url,
+                        "websocket_url": self.ws_tunnel_url
+                    })
+                    logger.info("[Sandbox:%s] Dev server restarted successfully", self.session_id)
+                else:
+                    logger.error("[Sandbox:%s] Failed to restart dev server", self.session_id)
     
-    def start_monitor(self):
-        """Start monitoring the server in a background thread"""
-        thread = threading.Thread(target=self._monitor_loop, daemon=True)
-        thread.start()
-        print(f"[Sandbox:{self.session_id}] Dev server monitor started")
-        return thread
-
-
+    def start_monitor(self) -> asyncio.Task:
+        """Start monitoring the server as a task on the running event loop"""
+        self.monitor_task = asyncio.get_running_loop().create_task(self._monitor_loop())
+        logger.info("[Sandbox:%s] Dev server monitor started", self.session_id)
+        return self.monitor_task
+    
+    async def stop(self):
+        """Stop monitoring and terminate the server, including one a restart is still bringing up"""
+        self.monitor_running.clear()
+        if self.monitor_task is not None:
+            self.monitor_task.cancel()
+            await asyncio.gather(self.monitor_task, return_exceptions=True)
+        processes = [self.process]
+        if self.pending_start is not None:
+            processes.append(await self.pending_start)
+        self.process = self.pending_start = None
+        for process in processes:
+            await asyncio.to_thread(self._stop_process, process)
+        logger.info("[Sandbox:%s] Dev server stopped", self.session_id)
@@ -0,0 +1,168 @@
+"""
+Lightweight pure-ASGI middleware for the Claude Agent API
+"""
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Pre-encoded CORS headers appended to every HTTP response
+CORS_HEADERS = (
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-methods", b"*"),
+    (b"access-control-allow-headers", b"*"),
+    (b"access-control-expose-headers", b"*"),
+)
+
+
+class FastCORS:
+    """Permissive CORS without Starlette's per-request origin matching"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Answer preflights directly - every origin, method and header is allowed
+        if scope["method"] == "OPTIONS":
+            await send({"type": "http.response.start", "status": 204, "headers": list(CORS_HEADERS)})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *CORS_HEADERS]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+
+# Server-side (max_age, stale_while_revalidate) seconds for GET paths whose responses carry
+# no Cache-Control header; kept internal so browsers and proxies never cache these
+DEFAULT_CACHE_TTLS = {
+    "/openapi.json": (3600.0, 0.0),
+    # Static health payload; a short TTL still skips routing for bursts of probes
+    "/": (60.0, 0.0),
+    # Per-user, changing data that other containers and the sandbox also write: keep it short
+    "/api/sessions": (1.0, 1.0),
+}
+
+# Upper bound on cached responses (query strings are client-controlled)
+CACHE_MAX_ENTRIES = 4096
+
+# Methods that cannot change server state, so they never invalidate the cache
+SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "TRACE"})
+
+
+def _cache_policy(headers, default_policy):
+    """Return (max_age, stale_while_revalidate) for a response, or None if it must not be cached"""
+    for name, value in headers:
+        if name.lower() != b"cache-control":
+            continue
+        directives = {}
+        for part in value.decode("latin-1").split(","):
+            directive, _, argument = part.strip().partition("=")
+            directives[directive.lower()] = argument
+        if directives.keys() & {"no-store", "no-cache", "private"}:
+            return None
+        try:
+            max_age = float(directives["max-age"])
+            stale = float(directives.get("stale-while-revalidate") or 0)
+        except (KeyError, ValueError):
+            break
+        return max_age, stale
+    return default_policy
+
+
+async def _empty_receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def _discard_send(message):
+    pass
+
+
+class TTLCacheMiddleware:
+    """
+    In-process GET response cache honoring Cache-Control max-age and
+    stale-while-revalidate: stale entries are served immediately while a
+    background task re-runs the handler to refresh them.
+    """
+
+    def __init__(self, app, default_ttls: dict = DEFAULT_CACHE_TTLS):
+        self.app = app
+        self.default_ttls = default_ttls
+        self._cache = {}  # (path, query) -> (fresh_until, stale_until, status, headers, body)
+        self._refreshing = {}  # (path, query) -> refresh task
+        self._generation = 0  # bumped on every invalidation so in-flight fetches cannot store stale bodies
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] != "GET":
+            if scope["method"] not in SAFE_METHODS:
+                # Any write may change what the cached listings return
+                self._cache.clear()
+                self._generation += 1
+            await self.app(scope, receive, send)
+            return
+
+        key = (scope["path"], scope["query_string"])
+        cached = self._cache.get(key)
+        if cached:
+            fresh_until, stale_until, status, headers, body = cached
+            now = time.monotonic()
+            if now < stale_until:
+                if now >= fresh_until and key not in self._refreshing:
+                    task = asyncio.create_task(self._fetch(dict(scope), _empty_receive, _discard_send, key))
+                    self._refreshing[key] = task
+                    task.add_done_callback(lambda t: self._refresh_done(key, t))
+                await send({"type": "http.response.start", "status": status, "headers": list(headers)})
+                await send({"type": "http.response.body", "body": body})
+                return
+
+        await self._fetch(scope, receive, send, key)
+
+    async def _fetch(self, scope, receive, send, key):
+        """Run the app, forwarding its response and caching it when cacheable"""
+        generation = self._generation
+        status = None
+        headers = ()
+        body_parts = []
+
+        async def send_and_capture(message):
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                # Snapshot before outer middleware appends its own headers
+                status = message["status"]
+                headers = tuple(message.get("headers", ()))
+            elif message["type"] == "http.response.body":
+                body_parts.append(message.get("body", b""))
+                # A write that landed mid-fetch makes this body stale
+                if not message.get("more_body", False) and status == 200 and generation == self._generation:
+                    self._store(key, headers, b"".join(body_parts))
+            await send(message)
+
+        await self.app(scope, receive, send_and_capture)
+
+    def _refresh_done(self, key, task):
+        self._refreshing.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("[API] Background refresh of %s failed", key[0], exc_info=task.exception())
+
+    def _store(self, key, headers, body):
+        policy = _cache_policy(headers, self.default_ttls.get(key[0]))
+        if policy is None:
+            return
+        max_age, stale = policy
+        if key not in self._cache and len(self._cache) >= CACHE_MAX_ENTRIES:
+            self._cache.pop(next(iter(self._cache)))
+        fresh_until = time.monotonic() + max_age
+        self._cache[key] = (fresh_until, fresh_until + stale, 200, headers, body)
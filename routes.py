@@ -2,148 +2,151 @@
 FastAPI routes for the Claude Agent API
 """
 
+import asyncio
+import logging
 import uuid
-from datetime import datetime
-from fastapi import HTTPException
+from fastapi import APIRouter, BackgroundTasks, HTTPException
+import modal
 
 from models import ChatRequest, ChatResponse, SessionStatus
-from config import sessions, ws_urls
+from config import sessions, session_messages, ws_urls
 from agent import run_agent_in_sandbox
+from timestamps import now_iso
 
+logger = logging.getLogger(__name__)
 
+router = APIRouter()
+sessions_router = APIRouter(prefix="/api/sessions")
+
+# Static health check payload, built once
+ROOT_RESPONSE = {
+    "service": "Claude Agent API",
+    "status": "running",
+    "version": "1.0.0"
+}
+
+
+@router.get("/")
 async def root():
     """Health check endpoint"""
-    return {
-        "service": "Claude Agent API",
-        "status": "running",
-        "version": "1.0.0"
-    }
+    return ROOT_RESPONSE
 
 
+@router.post("/api/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest) -> ChatResponse:
     """
     Handle chat requests - create new sessions or add messages to existing ones
     """
     session_id = request.session_id or str(uuid.uuid4())
-    print(f"[API] POST /api/chat - session_id: {session_id}")
-    print(f"[API] Message: {request.message[:100]}..." if len(request.message) > 100 else f"[API] Message: {request.message}")
+    logger.info("[API] POST /api/chat - session_id: %s", session_id)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("[API] Message: %.100s%s", request.message, "..." if len(request.message) > 100 else "")
+    
+    # One timestamp for everything this request records
+    timestamp = now_iso()
     
-    is_new_session = not sessions.contains(session_id)
-    print(f"[API] New session: {is_new_session}")
+    existing_session = await sessions.get.aio(session_id)
+    logger.info("[API] New session: %s", existing_session is None)
     
     # Check if session exists and is running - return it so frontend can use WebSocket
-    if not is_new_session:
-        existing_session = sessions[session_id]
-        print(f"[API] Existing session {session_id} found (status: {existing_session.get('status')})")
+    if existing_session is not None:
+        logger.info("[API] Existing session %s found (status: %s)", session_id, existing_session.get("status"))
         
-        # Add message to session history for tracking
-        existing_session["messages"].append({
-            "role": "user",
-            "content": request.message,
-            "timestamp": datetime.utcnow().isoformat()
-        })
-        existing_session["last_activity"] = datetime.utcnow().isoformat()
-        sessions[session_id] = existing_session
+        # Append only the new message; the session record stays small and is rewritten alongside it
+        existing_session["last_activity"] = timestamp
+        await asyncio.gather(
+            session_messages.put.aio({
+                "role": "user",
+                "content": request.message,
+                "timestamp": timestamp
+            }, partition=session_id),
+            sessions.put.aio(session_id, existing_session)
+        )
         
-        print(f"[API] Message added to session history. Frontend should send via WebSocket.")
+        logger.info("[API] Message added to session history. Frontend should send via WebSocket.")
         
-        return ChatResponse(
+        # Response models are filled from server-generated values, so construction skips validation
+        return ChatResponse.model_construct(
             session_id=session_id,
             message="Send this message via WebSocket to the running sandbox",
             status=existing_session["status"],
             sandbox_id=existing_session.get("sandbox_id"),
-            websocket_url=ws_urls.get(session_id) or existing_session.get("websocket_url"),
+            websocket_url=await ws_urls.get.aio(session_id) or existing_session.get("websocket_url"),
             dev_url=existing_session.get("dev_url")
         )
     
-    if is_new_session:
-        print(f"[API] Creating new session {session_id}")
-        sessions[session_id] = {
+    logger.info("[API] Creating new session %s", session_id)
+    initial_session = {
+        "session_id": session_id,
+        "status": "initializing",
+        "created_at": timestamp,
+        "last_activity": timestamp,
+        "sandbox_id": None,
+        "websocket_url": None,
+        "dev_url": None
+    }
+    await sessions.put.aio(session_id, initial_session)
+    
+    try:
+        logger.info("[API] Spawning sandbox for session %s", session_id)
+        call = await run_agent_in_sandbox.spawn.aio(
+            session_id=session_id,
+            prompt=request.message
+        )
+        
+        logger.info("[API] Sandbox spawned with ID: %s", call.object_id)
+
+        websocket_url = await ws_urls.get.aio(session_id)
+        new_session_info = {
             "session_id": session_id,
-            "status": "initializing",
-            "created_at": datetime.utcnow().isoformat(),
-            "last_activity": datetime.utcnow().isoformat(),
-            "messages": [],
-            "sandbox_id": None,
-            "websocket_url": None,
-            "dev_url": None
+            "status": "running",
+            "sandbox_id": call.object_id,
+            "websocket_url": websocket_url,
+            "dev_url": None,
+            "created_at": initial_session["created_at"],
+            "last_activity": timestamp
         }
+        await sessions.put.aio(session_id, new_session_info)
         
-        try:
-            print(f"[API] Spawning sandbox for session {session_id}")
-            call = run_agent_in_sandbox.spawn(
-                session_id=session_id,
-                prompt=request.message
-            )
-            
-            print(f"[API] Sandbox spawned with ID: {call.object_id}")
-
-            new_session_info = {
-                "session_id": session_id,
-                "status": "running",
-                "sandbox_id": call.object_id,
-                "websocket_url": ws_urls.get(session_id),
-                "dev_url": None,
-                "created_at": sessions[session_id]["created_at"],
-                "last_activity": datetime.utcnow().isoformat(),
-                "messages": sessions[session_id]["messages"]
-            }
-            sessions[session_id] = new_session_info
-            
-            print(f"[API] Session {session_id} started successfully")
-            return ChatResponse(
-                session_id=session_id,
-                message="Building your website...",
-                status="running",
-                sandbox_id=call.object_id,
-                websocket_url=ws_urls.get(session_id),
-                dev_url=None
-            )
-            
-        except Exception as e:
-            print(f"[API] ERROR starting session {session_id}: {type(e).__name__}: {e}")
-            sessions[session_id]["status"] = "error"
-            raise HTTPException(status_code=500, detail=str(e))
-    
-    else:
-        print(f"[API] Using existing session {session_id}")
-        session = sessions[session_id]
-        session["last_activity"] = datetime.utcnow().isoformat()
-        session["messages"].append({
-            "role": "user",
-            "content": request.message,
-            "timestamp": datetime.utcnow().isoformat()
-        })
-        print(f"[API] Added message to session {session_id} (status: {session['status']})")
-        
-        return ChatResponse(
+        logger.info("[API] Session %s started successfully", session_id)
+        return ChatResponse.model_construct(
             session_id=session_id,
-            message="Message added to existing session",
-            status=session["status"],
-            sandbox_id=session["sandbox_id"],
-            websocket_url=session["websocket_url"],
-            dev_url=session.get("dev_url")
+            message="Building your website...",
+            status="running",
+            sandbox_id=call.object_id,
+            websocket_url=websocket_url,
+            dev_url=None
         )
-
-
-async def get_session(session_id: str) -> SessionStatus:
+        
+    except Exception as e:
+        logger.error("[API] ERROR starting session %s: %s: %s", session_id, type(e).__name__, e)
+        failed_session = await sessions.get.aio(session_id)
+        # Deleted while the sandbox was spawning: nothing left to mark, report the original error
+        if failed_session is not None:
+            failed_session["status"] = "error"
+            await sessions.put.aio(session_id, failed_session)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@sessions_router.get("/{session_id}", response_model=SessionStatus)
+async def get_session(session_id: str, background_tasks: BackgroundTasks) -> SessionStatus:
     """
     Get status and details of a specific session
     """
-    print(f"[API] GET /api/sessions/{session_id}")
-    if session_id not in sessions:
-        print(f"[API] Session {session_id} not found")
+    logger.info("[API] GET /api/sessions/%s", session_id)
+    session = await sessions.get.aio(session_id)
+    if session is None:
+        logger.info("[API] Session %s not found", session_id)
         raise HTTPException(status_code=404, detail="Session not found")
     
-    session = sessions[session_id]
-    
-    websocket_url = ws_urls.get(session_id) or session.get("websocket_url")
+    websocket_url = await ws_urls.get.aio(session_id) or session.get("websocket_url")
     if websocket_url and session.get("websocket_url") != websocket_url:
         session["websocket_url"] = websocket_url
-        sessions[session_id] = session
+        # Persist the refreshed URL after the response is sent
+        background_tasks.add_task(sessions.put.aio, session_id, session)
     
-    print(f"[API] Returning session {session_id} (status: {session['status']}, ws_url: {websocket_url is not None})")
-    return SessionStatus(
+    logger.info("[API] Returning session %s (status: %s, ws_url: %s)", session_id, session["status"], websocket_url is not None)
+    return SessionStatus.model_construct(
         session_id=session_id,
         status=session["status"],
         sandbox_id=session.get("sandbox_id"),
@@ -154,37 +157,56 @@ async def get_session(session_id: str) -> SessionStatus:
     )
 
 
+@sessions_router.get("")
 async def list_sessions():
     """
     List all active sessions
     """
-    print("[API] GET /api/sessions")
+    # Cached in-process for a second or two (see middleware.DEFAULT_CACHE_TTLS), never by clients
+    logger.info("[API] GET /api/sessions")
+    # One scan of ws_urls joined locally instead of a get per session
+    ws_snapshot = {session_id: url async for session_id, url in ws_urls.items.aio()}
     session_list = []
-    for session_id, session in sessions.items():
-        websocket_url = ws_urls.get(session_id) or session.get("websocket_url")
+    async for session_id, session in sessions.items.aio():
+        websocket_url = ws_snapshot.get(session_id) or session.get("websocket_url")
         if websocket_url:
             session["websocket_url"] = websocket_url
         session_list.append(session)
     
     session_count = len(session_list)
-    print(f"[API] Returning {session_count} sessions")
+    logger.info("[API] Returning %d sessions", session_count)
     return {
         "sessions": session_list,
         "total": session_count
     }
 
 
+@sessions_router.delete("/{session_id}")
 async def delete_session(session_id: str):
     """
     Delete a session
     """
-    print(f"[API] DELETE /api/sessions/{session_id}")
-    if session_id not in sessions:
-        print(f"[API] Session {session_id} not found")
+    logger.info("[API] DELETE /api/sessions/%s", session_id)
+    session = await sessions.pop.aio(session_id, None)
+    if session is None:
+        logger.info("[API] Session %s not found", session_id)
         raise HTTPException(status_code=404, detail="Session not found")
 
-    del sessions[session_id]
-    print(f"[API] Session {session_id} deleted")
+    logger.info("[API] Session %s deleted", session_id)
+
+    await session_messages.clear.aio(partition=session_id)
+
+    # Release the sandbox now instead of letting it idle until the function timeout
+    sandbox_id = session.get("sandbox_id")
+    if sandbox_id:
+        try:
+            call = await modal.FunctionCall.from_id.aio(sandbox_id)
+            await call.cancel.aio()
+            logger.info("[API] Cancelled sandbox %s for session %s", sandbox_id, session_id)
+        except Exception as e:
+            logger.warning("[API] Could not cancel sandbox %s: %s: %s", sandbox_id, type(e).__name__, e)
 
     return {"message": "Session deleted", "session_id": session_id}
 
+
+router.include_router(sessions_router)
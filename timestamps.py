@@ -0,0 +1,18 @@
+"""
+Shared timestamp helper for session records and events
+"""
+
+import time
+from datetime import datetime, timezone
+
+# Last formatted timestamp, reused for calls within the same millisecond
+_ts_cache = {"t": 0.0, "s": ""}
+
+
+def now_iso() -> str:
+    """ISO-8601 UTC timestamp (with +00:00 offset), reformatted at most once per millisecond"""
+    now = time.time()
+    if now - _ts_cache["t"] > 0.001:
+        _ts_cache["s"] = datetime.fromtimestamp(now, timezone.utc).isoformat()
+        _ts_cache["t"] = now
+    return _ts_cache["s"]